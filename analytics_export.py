@@ -0,0 +1,255 @@
+import argparse
+import datetime
+import logging
+import os
+import shutil
+from typing import Dict, List
+
+from pymongo import MongoClient
+
+from purchases_crawler.purchases_crawler.items import parse_date
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+UNDATED = 'unknown'
+# Low-cardinality text columns are dictionary-encoded: each distinct value is stored once per row group
+CATEGORICAL = {'customer', 'region', 'currency', 'suppliers_status', 'code', 'unit'}
+COLUMNS = {
+    'purchases': [('id', 'string'), ('url', 'string'), ('object', 'string'), ('customer', 'string'),
+                  ('placement_date', 'timestamp'), ('application_deadline', 'timestamp'), ('region', 'string'),
+                  ('start_price', 'float'), ('currency', 'string'), ('suppliers_status', 'string'),
+                  ('positions', 'int'), ('suppliers', 'int')],
+    'positions': [('id', 'string'), ('position', 'int'), ('code', 'string'), ('name', 'string'), ('unit', 'string'),
+                  ('quantity', 'float'), ('price_per_unit', 'float'), ('total_price', 'float')],
+    'suppliers': [('id', 'string'), ('position', 'int'), ('name', 'string'), ('number', 'string'), ('offer', 'float')],
+}
+PROJECTION = {'_id': 0, 'id': 1, 'url': 1, 'object': 1, 'customer': 1, 'placement_date': 1, 'application_deadline': 1,
+              'region': 1, 'start_price': 1, 'currency': 1, 'suppliers_status': 1, 'purchase_positions': 1, 'suppliers': 1}
+
+
+def arrow_type(column: str, kind: str):
+    if kind == 'string':
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string()) if column in CATEGORICAL else pyarrow.string()
+    return {'timestamp': pyarrow.timestamp('ms'), 'float': pyarrow.float64(), 'int': pyarrow.int32()}[kind]
+
+
+def schema(table: str):
+    return pyarrow.schema([(column, arrow_type(column, kind)) for column, kind in COLUMNS[table]])
+
+
+def number(value):
+    # Purchases stored before numbers were typed may hold them as text
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).replace(',', '.').replace(' ', ''))
+    except ValueError:
+        return None
+
+
+def timestamp(value):
+    # Purchases stored before dates were typed hold the page text, e.g. '01.02.2021'
+    if isinstance(value, datetime.datetime):
+        return value
+    return parse_date(value) if isinstance(value, str) else None
+
+
+class MonthWriter:
+    # Writes one placement month into <out-dir>/<table>/month=YYYY-MM/part-0.parquet, one row group per chunk.
+    # The month is written next to its final place and swapped in when complete, so readers never see half a month.
+    def __init__(self, out_dir: str, month: str, compression: str):
+        self.out_dir = out_dir
+        self.month = month
+        self.compression = compression
+        self.rows = {table: {column: [] for column, _ in COLUMNS[table]} for table in COLUMNS}
+        self.writers = {}
+        self.counts = {table: 0 for table in COLUMNS}
+
+    def directory(self, table: str, suffix: str = '') -> str:
+        return os.path.join(self.out_dir, table, f'month={self.month}{suffix}')
+
+    def add(self, document: dict):
+        positions = document.get('purchase_positions') or []
+        suppliers = document.get('suppliers') or []
+        self.append('purchases', id=document['id'], url=document.get('url'), object=document.get('object'),
+                    customer=document.get('customer'), placement_date=timestamp(document.get('placement_date')),
+                    application_deadline=timestamp(document.get('application_deadline')), region=document.get('region'),
+                    start_price=number(document.get('start_price')), currency=document.get('currency'),
+                    suppliers_status=document.get('suppliers_status'), positions=len(positions), suppliers=len(suppliers))
+        for index, position in enumerate(positions):
+            self.append('positions', id=document['id'], position=index, code=position.get('code'), name=position.get('name'),
+                        unit=position.get('unit'), quantity=number(position.get('quantity')),
+                        price_per_unit=number(position.get('price_per_unit')), total_price=number(position.get('total_price')))
+        for index, supplier in enumerate(suppliers):
+            self.append('suppliers', id=document['id'], position=index, name=supplier.get('name'),
+                        number=supplier.get('number'), offer=number(supplier.get('offer')))
+
+    def append(self, table: str, **row):
+        for column, values in self.rows[table].items():
+            values.append(row[column])
+
+    def flush(self):
+        for table, columns in self.rows.items():
+            rows = len(columns['id'])
+            if not rows:
+                continue
+            table_schema = schema(table)
+            arrays = [pyarrow.array(columns[field.name], type=field.type.value_type).dictionary_encode()
+                      if pyarrow.types.is_dictionary(field.type) else pyarrow.array(columns[field.name], type=field.type)
+                      for field in table_schema]
+            if table not in self.writers:
+                directory = self.directory(table, '.tmp')
+                shutil.rmtree(directory, ignore_errors=True)
+                os.makedirs(directory)
+                self.writers[table] = pyarrow.parquet.ParquetWriter(os.path.join(directory, 'part-0.parquet'), table_schema,
+                                                                    compression=self.compression)
+            self.writers[table].write_table(pyarrow.Table.from_arrays(arrays, schema=table_schema))
+            self.counts[table] += rows
+            for values in columns.values():
+                values.clear()
+
+    def close(self):
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
+        for table in COLUMNS:
+            if table not in self.writers:
+                # A month without rows of a table (e.g. no supplier results yet) drops what an earlier export wrote
+                shutil.rmtree(self.directory(table), ignore_errors=True)
+                continue
+            # The old month is moved aside before the new one takes its place, and deleted only then
+            shutil.rmtree(self.directory(table, '.old'), ignore_errors=True)
+            if os.path.exists(self.directory(table)):
+                os.replace(self.directory(table), self.directory(table, '.old'))
+            os.replace(self.directory(table, '.tmp'), self.directory(table))
+            shutil.rmtree(self.directory(table, '.old'), ignore_errors=True)
+
+
+def month_start(month: str) -> datetime.datetime:
+    return datetime.datetime.strptime(month, '%Y-%m')
+
+
+def next_month(start: datetime.datetime) -> datetime.datetime:
+    return (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+def legacy_dates(collection) -> Dict[str, List[str]]:
+    # Placement dates stored as text, by month; a few thousand distinct days at most. Unparseable ones are undated.
+    months = {}
+    for text in collection.distinct('placement_date', {'placement_date': {'$type': 'string'}}):
+        placement_date = parse_date(text)
+        months.setdefault(placement_date.strftime('%Y-%m') if placement_date else UNDATED, []).append(text)
+    return months
+
+
+def stored_months(collection, legacy: Dict[str, List[str]]) -> List[str]:
+    # From the first to the last placement date of the collection, oldest first
+    months = {month for month in legacy if month != UNDATED}
+    first = collection.find_one({'placement_date': {'$type': 'date'}}, {'placement_date': 1}, sort=[('placement_date', 1)])
+    last = collection.find_one({'placement_date': {'$type': 'date'}}, {'placement_date': 1}, sort=[('placement_date', -1)])
+    if first is not None:
+        start = first['placement_date'].replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        while start <= last['placement_date']:
+            months.add(start.strftime('%Y-%m'))
+            start = next_month(start)
+    return sorted(months)
+
+
+def month_query(month: str, legacy: Dict[str, List[str]]) -> dict:
+    if month == UNDATED:
+        return {'$or': [{'placement_date': None}, {'placement_date': {'$in': legacy.get(UNDATED, [])}}]}
+    start = month_start(month)
+    query = {'placement_date': {'$gte': start, '$lt': next_month(start)}}
+    if month in legacy:
+        query = {'$or': [query, {'placement_date': {'$in': legacy[month]}}]}
+    return query
+
+
+def exported_months(out_dir: str) -> set:
+    directory = os.path.join(out_dir, 'purchases')
+    if not os.path.isdir(directory):
+        return set()
+    return {name[len('month='):] for name in os.listdir(directory)
+            if name.startswith('month=') and not name.endswith(('.tmp', '.old'))}
+
+
+def months_to_export(months, exported: set, refresh_months: int, requested, undated: bool) -> list:
+    # New months are appended; the latest ones are exported again because cards still arrive and supplier
+    # results patch purchases for a while after placement. Undated purchases are exported once, then on request.
+    if requested:
+        return list(requested)
+    refreshed = set(months[-refresh_months:]) if refresh_months > 0 else set()
+    months = [month for month in months if month not in exported or month in refreshed]
+    if undated and UNDATED not in exported:
+        months.append(UNDATED)
+    return months
+
+
+def has_index(collection, field: str) -> bool:
+    return any(index['key'][0][0] == field for index in collection.index_information().values())
+
+
+def export_month(collection, out_dir: str, month: str, legacy: Dict[str, List[str]], chunk_size: int, compression: str) -> dict:
+    writer = MonthWriter(out_dir, month, compression)
+    exported = 0
+    for document in collection.find(month_query(month, legacy), PROJECTION).batch_size(chunk_size):
+        if not document.get('id'):
+            continue
+        writer.add(document)
+        exported += 1
+        if exported % chunk_size == 0:
+            writer.flush()
+    writer.close()
+    return writer.counts
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Exports stored purchases into Parquet tables of purchases, positions and '
+                                                 'suppliers (linked by id), partitioned by placement month.')
+    parser.add_argument('-cs', '--connection-string', help='Connection string to mongo db, with the database name and any '
+                                                     'credentials', action='store', default='mongodb://localhost:27017/zakupki')
+    parser.add_argument('-c', '--collection', help='Collection name', action='store', default='purchases')
+    parser.add_argument('-o', '--out-dir', help='Output directory', action='store', default='analytics')
+    parser.add_argument('--month', help='Export this placement month (YYYY-MM, or unknown for purchases without a '
+                                        'placement date) even if exported before, may be repeated', action='append', default=[])
+    parser.add_argument('--refresh-months', help='Export the latest months again even if exported before', type=int, default=3)
+    parser.add_argument('--compression', help='Parquet compression codec', choices=['snappy', 'zstd', 'gzip', 'none'], default='zstd')
+    parser.add_argument('--chunk-size', help='Purchases per row group', type=int, default=10000)
+    parser.add_argument('--create-index', help='Create the placement_date index month queries need, once per collection '
+                                               '(builds an index on the collection the crawler writes to)', action='store_true')
+    args = parser.parse_args()
+    if pyarrow is None:
+        parser.error('analytics export requires the pyarrow package')
+    for month in args.month:
+        if month != UNDATED:
+            try:
+                month_start(month)
+            except ValueError:
+                parser.error(f'invalid month: {month}')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+    client = MongoClient(args.connection_string)
+    collection = client.get_database()[args.collection]
+    try:
+        if args.create_index:
+            collection.create_index([('placement_date', 1)])
+        elif not has_index(collection, 'placement_date'):
+            logging.warning('No placement_date index: every month scans the whole collection. Run once with --create-index.')
+        legacy = legacy_dates(collection)
+        undated = collection.find_one(month_query(UNDATED, legacy), {'_id': 1}) is not None
+        months = months_to_export(stored_months(collection, legacy), exported_months(args.out_dir), args.refresh_months,
+                                  args.month, undated)
+        for month in months:
+            counts = export_month(collection, args.out_dir, month, legacy, args.chunk_size, args.compression)
+            logging.info(f'Exported {month}. Purchases: {counts["purchases"]} Positions: {counts["positions"]} '
+                         f'Suppliers: {counts["suppliers"]}')
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,222 @@
+# Micro-benchmark of card/supplier page extraction: the original selector-per-field spider code
+# against CardExtractor, on saved pages or on synthetic ones from benchmarks.pages.
+#
+#     python -m benchmarks.bench_card_extractor [-n 200] [--suppliers saved_supplier_page.html ...] [saved_card_page.html ...]
+import argparse
+import re
+import time
+import tracemalloc
+from typing import Optional
+
+from scrapy.http import HtmlResponse, Request
+
+from benchmarks.pages import card_page, suppliers_page
+from purchases_crawler.purchases_crawler.items import PurchasePosition, Supplier, parse_date
+from purchases_crawler.purchases_crawler.spiders.goszakupki.card_extractor import CardExtractor
+
+normalization_pattern = re.compile(r'\s+|\r|\n|\r\n')
+
+
+class LegacyCardParser:
+    # parse_card/parse_suppliers/parse_table as they were before CardExtractor, kept as the baseline
+
+    def parse_card(self, response):
+        id = response.css('span.cardMainInfo__purchaseLink a::text').get(default='')
+        main_info = response.css('div.sectionMainInfo__body')
+        purchase_object = ''
+        customer = None
+        if main_info:
+            main_info_sections = main_info.css('div.cardMainInfo__section')
+            for main_info_section in main_info_sections:
+                main_info_section_title = main_info_section.css('span.cardMainInfo__title::text').get()
+                if main_info_section_title and 'Объект закупки' in main_info_section_title:
+                    purchase_object = main_info_section.css('span.cardMainInfo__content::text').get(default='')
+
+        application_deadline = None
+        placement_date = None
+        date_div = response.css('div.date')
+        if date_div:
+            sections = date_div.css('div.cardMainInfo__section')
+            for section in sections:
+                section_title = section.css('span.cardMainInfo__title::text').get()
+                if section_title and 'Размещено' in section_title:
+                    placement_date = section.css('span.cardMainInfo__content::text').get(default='').strip()
+                if section_title and 'Окончание подачи заявок' in section_title:
+                    application_deadline = section.css('span.cardMainInfo__content::text').get(default='').strip()
+
+        region = None
+        start_price = None
+        currency = None
+        purchase_positions = []
+        blocks = response.css('div.blockInfo')
+        for block in blocks:
+            block_title = block.css('h2.blockInfo__title').get()
+            if block_title and 'Контактная информация' in block_title:
+                sections = block.css('section')
+                for section in sections:
+                    section_title = section.css('span.section__title::text').get()
+                    if section_title and 'Организация' in section_title:
+                        customer = section.css('span.section__info::text').get(default='').strip()
+                    if section_title and 'Регион' in section_title:
+                        region = section.css('span.section__info::text').get(default='').strip()
+            if block_title and 'цена контракта' in block_title:
+                sections = block.css('section')
+                for section in sections:
+                    section_title = section.css('span.section__title::text').get()
+                    if section_title and 'цена контракта' in section_title:
+                        start_price = section.css('span.section__info::text').get(default='').strip()
+                    if section_title and 'Валюта' in section_title:
+                        currency = section.css('span.section__info::text').get(default='').strip()
+            if block_title and 'Информация об объекте закупки' in block_title:
+                purchase_positions = self.parse_table(block.css('table.tableBlock'), CardExtractor.PURCHASE_POSITION_COLUMNS, response.request.url)
+                for position in purchase_positions:
+                    position['quantity'] = self.parse_number(position.get('quantity'))
+                    position['price_per_unit'] = self.parse_number(position.get('price_per_unit'))
+                    position['total_price'] = self.parse_number(position.get('total_price'))
+
+        return {
+            'id': id.replace('№', '').strip(),
+            'url': response.request.url,
+            'object': self.normalize_string(purchase_object),
+            'customer': customer,
+            'placement_date': placement_date,
+            'application_deadline': application_deadline,
+            'region': region,
+            'start_price': self.parse_number(start_price),
+            'currency': currency,
+            'purchase_positions': purchase_positions
+        }
+
+    def parse_suppliers(self, response) -> Optional[list]:
+        supplier_div = response.css('div[id^=supplier-def-result-participant-table]')
+        if not supplier_div:
+            return None
+        suppliers = self.parse_table(supplier_div.css('table'), CardExtractor.SUPPLIER_COLUMNS, response.request.url)
+        for supplier in suppliers:
+            supplier['offer'] = self.parse_number(supplier.get('offer'))
+        return suppliers
+
+    def parse_table(self, table, column_mapping, url) -> []:
+        result = []
+        index_mapping = {}
+        excluded_idx = []
+        if table:
+            thead = table.css('thead')
+            if len(thead) > 1:
+                thead = thead[0]
+            column_headers = thead.css('th, td')
+            for idx, column_header in enumerate(column_headers):
+                column_header_text = column_header.css('::text').get().strip()
+                column_name = column_mapping.get(column_header_text)
+                if column_name:
+                    index_mapping[idx] = column_name
+                else:
+                    excluded_idx.append(idx)
+            tbody = table.css('tbody.tableBlock__body')
+            rows = tbody.css('tr.tableBlock__row, table')
+            for row in rows:
+                if row.root.tag == 'table':
+                    break
+                cells = row.css('td.tableBlock__col')
+                record = {}
+                for idx, cell in enumerate(cells):
+                    name = index_mapping.get(idx)
+                    if name:
+                        values = cell.css('::text, *::text').getall()
+                        record[name] = self.normalize_string(' '.join(values))
+                result.append(record)
+        return result
+
+    def normalize_string(self, input_str: str) -> str:
+        return normalization_pattern.sub(' ', input_str).strip()
+
+    def parse_number(self, input_str: str) -> Optional[float]:
+        if not input_str:
+            return None
+        return float(re.sub(r',', '.', re.findall(r'[-+]?\d*[.,]\d+|\d+', re.sub(r'\s', '', input_str.strip()))[0]))
+
+
+def load_pages(paths, synthetic, generate):
+    if paths:
+        pages = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                pages.append(f.read())
+        return pages
+    return [generate(f'03731000646210{idx:05d}', idx) for idx in range(synthetic)]
+
+
+def response(url: str, body: bytes) -> HtmlResponse:
+    return HtmlResponse(url, body=body, encoding='utf-8', request=Request(url))
+
+
+def typed_card(card: dict) -> dict:
+    # Legacy output in the typed item schema: dates parsed, columns missing from the page as None
+    return dict(card, placement_date=parse_date(card['placement_date']),
+                application_deadline=parse_date(card['application_deadline']),
+                purchase_positions=[PurchasePosition(**position)._asdict() for position in card['purchase_positions']],
+                suppliers_status=None)
+
+
+def retained_kb(function, responses) -> float:
+    # Memory held by the parse results of all pages, i.e. what sits in queues and pipeline batches
+    tracemalloc.start()
+    results = [function(response) for response in responses]
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    return retained / 1024
+
+
+def measure(label: str, function, responses, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for response in responses:
+            function(response)
+    elapsed = time.perf_counter() - started
+    per_page = elapsed / (iterations * len(responses)) * 1000
+    print(f'{label:<32} {per_page:8.3f} ms/page')
+    return per_page
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cards', nargs='*', help='Saved card pages (synthetic pages are used when none are given)')
+    parser.add_argument('--suppliers', nargs='*', default=[], help='Saved supplier result pages')
+    parser.add_argument('-n', '--iterations', type=int, default=100)
+    parser.add_argument('--positions', type=int, default=20, help='Purchase positions per synthetic card')
+    args = parser.parse_args()
+
+    cards = load_pages(args.cards, 20, lambda id, idx: card_page(id, '01.02.2021', positions=args.positions + idx % 5).encode('utf-8'))
+    suppliers = load_pages(args.suppliers, 20, lambda id, idx: suppliers_page(id, suppliers=1 + idx % 5).encode('utf-8'))
+    card_responses = [response(f'https://zakupki.gov.ru/card/{idx}', body) for idx, body in enumerate(cards)]
+    supplier_responses = [response(f'https://zakupki.gov.ru/suppliers/{idx}', body) for idx, body in enumerate(suppliers)]
+    for page in card_responses + supplier_responses:
+        page.selector.root
+
+    legacy = LegacyCardParser()
+    extractor = CardExtractor()
+    for page in card_responses:
+        expected = legacy.parse_card(page)
+        expected = typed_card(expected)
+        actual = extractor.extract_card(page.selector.root, page.request.url).as_document()
+        assert actual == expected, f'Card output differs: {page.url}\n{expected}\n{actual}'
+    for page in supplier_responses:
+        expected = [Supplier(**supplier) for supplier in legacy.parse_suppliers(page)]
+        actual = extractor.extract_suppliers(page.selector.root, page.request.url)
+        assert actual == expected, f'Suppliers output differs: {page.url}\n{expected}\n{actual}'
+    print(f'Outputs match on {len(card_responses)} cards and {len(supplier_responses)} supplier pages')
+
+    legacy_card = measure('legacy parse_card', legacy.parse_card, card_responses, args.iterations)
+    fast_card = measure('CardExtractor.extract_card', lambda r: extractor.extract_card(r.selector.root, r.request.url), card_responses, args.iterations)
+    legacy_suppliers = measure('legacy parse_suppliers', legacy.parse_suppliers, supplier_responses, args.iterations)
+    fast_suppliers = measure('CardExtractor.extract_suppliers', lambda r: extractor.extract_suppliers(r.selector.root, r.request.url), supplier_responses, args.iterations)
+    print(f'Speedup: cards x{legacy_card / fast_card:.1f}, suppliers x{legacy_suppliers / fast_suppliers:.1f}')
+    legacy_memory = retained_kb(legacy.parse_card, card_responses)
+    typed_memory = retained_kb(lambda r: extractor.extract_card(r.selector.root, r.request.url), card_responses)
+    print(f'Retained per card: legacy dicts {legacy_memory / len(card_responses):.1f} KB, '
+          f'typed items {typed_memory / len(card_responses):.1f} KB')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,170 @@
+# End-to-end crawl benchmark: runs PurchaseObjectSpider against benchmarks.fake_registry (in a separate
+# process) with the in-memory purchase store, then reports throughput, download latency percentiles,
+# requests per item and peak memory.
+#
+#     python -m benchmarks.bench_crawl --days 3 --purchases-per-day 3000 --save result.json
+#     python -m benchmarks.bench_crawl --days 3 --compare result.json --tolerance 0.15
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+from benchmarks.fake_registry import SEARCH_PATH, serve
+from purchases_crawler.purchases_crawler.spiders.goszakupki.purchase_object_spider import PurchaseObjectSpider
+
+
+class CrawlMetrics:
+    def __init__(self):
+        self.latencies = []
+        self.started = None
+        self.first_item = None
+        self.finished = None
+
+    def connect(self, crawler):
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.response_received, signal=signals.response_received)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    def spider_opened(self, spider):
+        self.started = time.perf_counter()
+
+    def response_received(self, response, request, spider):
+        if 'download_latency' in request.meta:
+            self.latencies.append(request.meta['download_latency'])
+
+    def item_scraped(self, item, response, spider):
+        if self.first_item is None:
+            self.first_item = time.perf_counter()
+
+    def spider_closed(self, spider):
+        self.finished = time.perf_counter()
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def serve_registry(port_queue, registry_kwargs):
+    server = serve(**registry_kwargs)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def start_registry(**registry_kwargs) -> (multiprocessing.Process, int):
+    context = multiprocessing.get_context('spawn')
+    port_queue = context.Queue()
+    process = context.Process(target=serve_registry, args=(port_queue, registry_kwargs), daemon=True)
+    process.start()
+    return process, port_queue.get(timeout=30)
+
+
+def run_crawl(port: int, days: int, first_day: datetime.date, concurrency: int, spider_kwargs: dict, throttle: bool = False) -> dict:
+    os.environ['SCRAPY_SETTINGS_MODULE'] = 'purchases_crawler.purchases_crawler.settings'
+    settings = get_project_settings()
+    settings.set('ITEM_PIPELINES', {'purchases_crawler.purchases_crawler.pipelines.BatchedMongoPipeline': 300})
+    settings.set('ROBOTSTXT_OBEY', False)
+    settings.set('DOWNLOAD_DELAY', 0)
+    settings.set('CONCURRENT_REQUESTS', concurrency)
+    settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', concurrency)
+    settings.set('ADAPTIVE_THROTTLE_ENABLED', throttle)
+    settings.set('LOG_LEVEL', 'WARNING')
+    settings.set('TELNETCONSOLE_ENABLED', False)
+
+    metrics = CrawlMetrics()
+    crawler_process = CrawlerProcess(settings)
+    crawler = crawler_process.create_crawler(PurchaseObjectSpider)
+    metrics.connect(crawler)
+    last_day = first_day + datetime.timedelta(days=days - 1)
+    kwargs = dict(start_urls=[f'http://127.0.0.1:{port}{SEARCH_PATH}?morphology=on&fz44=on'],
+                  storage='memory', mode='range', date_from=first_day.isoformat(), date_to=last_day.isoformat())
+    kwargs.update(spider_kwargs)
+    cpu_started = time.process_time()
+    crawler_process.crawl(crawler, **kwargs)
+    crawler_process.start()
+    cpu = time.process_time() - cpu_started
+
+    stats = crawler.stats.get_stats()
+    elapsed = metrics.finished - metrics.started
+    # Supplier results come as separate patch items; count purchases
+    items = len(crawler.spider.store.documents)
+    requests = stats.get('downloader/request_count', 0)
+    return {
+        'days': days,
+        'items': items,
+        'requests': requests,
+        'pages': stats.get('response_received_count', 0),
+        'errors': stats.get('log_count/ERROR', 0),
+        'elapsed_seconds': round(elapsed, 3),
+        'cpu_seconds': round(cpu, 3),
+        'pages_per_second': round(stats.get('response_received_count', 0) / elapsed, 2),
+        'items_per_second': round(items / elapsed, 2),
+        'cpu_ms_per_item': round(cpu / items * 1000, 3) if items else None,
+        'requests_per_item': round(requests / items, 3) if items else None,
+        'time_to_first_item_seconds': round(metrics.first_item - metrics.started, 3) if metrics.first_item else None,
+        'latency_p50_ms': round(percentile(metrics.latencies, 0.5) * 1000, 2),
+        'latency_p90_ms': round(percentile(metrics.latencies, 0.9) * 1000, 2),
+        'latency_p99_ms': round(percentile(metrics.latencies, 0.99) * 1000, 2),
+        'peak_memory_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for key in ('pages_per_second', 'items_per_second'):
+        if baseline.get(key) and result[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f'{key}: {result[key]} < {baseline[key]}')
+    for key in ('cpu_ms_per_item', 'requests_per_item', 'peak_memory_mb'):
+        if baseline.get(key) and result[key] and result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f'{key}: {result[key]} > {baseline[key]}')
+    if result['items'] < baseline.get('items', 0):
+        regressions.append(f'items: {result["items"]} < {baseline["items"]}')
+    return regressions
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=2, help='Number of placement dates to crawl')
+    parser.add_argument('--first-day', default='2021-02-01')
+    parser.add_argument('--purchases-per-day', type=int, default=3000,
+                        help='Average purchases per day; above ~2700 the 1001..1000000 range exceeds the search limit')
+    parser.add_argument('--max-positions', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the fake registry adds to every response')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--throttle', action='store_true', help='Keep adaptive throttling on instead of crawling at full speed')
+    parser.add_argument('--save', help='Write the result as JSON to this file')
+    parser.add_argument('--compare', help='Baseline JSON result to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    registry, port = start_registry(purchases_per_day=args.purchases_per_day, max_positions=args.max_positions, latency=args.latency)
+    try:
+        result = run_crawl(port, args.days, datetime.date.fromisoformat(args.first_day), args.concurrency, {}, args.throttle)
+    finally:
+        registry.terminate()
+    print(json.dumps(result, indent=2))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
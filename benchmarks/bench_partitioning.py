@@ -0,0 +1,59 @@
+# Checks and times PricePartitionPlanner.split: every split of a range at least two prices wide must cover it
+# with adjacent, non-empty, strictly narrower intervals, otherwise the spider would search the same range again.
+#
+#     python -m benchmarks.bench_partitioning [-n 20000] [--seed 1]
+import argparse
+import random
+import time
+
+from purchases_crawler.purchases_crawler.partitioning import PricePartitionPlanner
+from purchases_crawler.purchases_crawler.spiders.goszakupki.purchase_object_spider import PurchaseObjectSpider
+
+MAX_ITEMS = PurchaseObjectSpider.MAX_ITEMS_PER_SEARCH
+
+
+def check_split(planner: PricePartitionPlanner, price_range, count: int):
+    intervals = planner.split('01.02.2021', price_range, count)
+    assert len(intervals) > 1, f'Range not split: {price_range} Count: {count}'
+    assert intervals[0][0] == price_range[0] and intervals[-1][1] == price_range[1], f'Range not covered: {price_range} {intervals}'
+    for (low, high), (next_low, _) in zip(intervals, intervals[1:]):
+        assert low <= high and next_low == high + 1, f'Intervals not adjacent: {price_range} {intervals}'
+    assert intervals[-1][0] <= intervals[-1][1], f'Empty interval: {price_range} {intervals}'
+
+
+def sample_ranges(count: int, seed: int):
+    rng = random.Random(seed)
+    # The narrowest ranges around every decade boundary, where rounding the cuts goes wrong first
+    for decade in range(13):
+        for price_from in (max(10 ** decade - 2, 0), 10 ** decade - 1, 10 ** decade):
+            for width in (1, 2, 3):
+                yield price_from, price_from + width
+    for _ in range(count):
+        price_from = int(10 ** rng.uniform(0, 12))
+        yield price_from, price_from + max(1, int(10 ** rng.uniform(0, 12)))
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--ranges', type=int, default=20000, help='Random ranges besides the boundary cases')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    ranges = list(sample_ranges(args.ranges, args.seed))
+    counts = [MAX_ITEMS + 1, MAX_ITEMS * 3, MAX_ITEMS * 40]
+    planner = PricePartitionPlanner(PurchaseObjectSpider.PRICE_INTERVALS, MAX_ITEMS)
+    for price_range in ranges:
+        for count in counts:
+            check_split(planner, price_range, count)
+    print(f'Splits valid on {len(ranges)} ranges x {len(counts)} result numbers')
+
+    planner = PricePartitionPlanner(PurchaseObjectSpider.PRICE_INTERVALS, MAX_ITEMS)
+    started = time.perf_counter()
+    for price_range in ranges:
+        planner.split('01.02.2021', price_range, MAX_ITEMS * 3)
+    elapsed = time.perf_counter() - started
+    print(f'{"PricePartitionPlanner.split":<32} {elapsed / len(ranges) * 1e6:8.1f} us/split')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,98 @@
+# Local stand-in for the procurement registry: serves search result, card and supplier pages
+# generated from a deterministic synthetic dataset.
+#
+#     python -m benchmarks.fake_registry --port 8080 --purchases-per-day 6000
+import argparse
+import datetime
+import functools
+import hashlib
+import random
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+from benchmarks.pages import card_page, search_page, suppliers_page
+
+SEARCH_PATH = '/epz/order/extendedsearch/results.html'
+CARD_PATH = '/epz/order/notice/ea44/view/common-info.html'
+SUPPLIERS_PATH = '/epz/order/notice/ea44/view/supplier-results.html'
+
+
+class Registry:
+    def __init__(self, purchases_per_day: int = 3000, max_positions: int = 30, latency: float = 0.0):
+        self.purchases_per_day = purchases_per_day
+        self.max_positions = max_positions
+        self.latency = latency
+
+    @functools.lru_cache(maxsize=64)
+    def purchases(self, placement_date: str) -> List[Tuple[str, int]]:
+        seed = int(hashlib.md5(placement_date.encode()).hexdigest()[:8], 16)
+        rnd = random.Random(seed)
+        day = datetime.datetime.strptime(placement_date, '%d.%m.%Y')
+        count = rnd.randint(self.purchases_per_day // 2, self.purchases_per_day * 3 // 2)
+        # Prices are log-normal around 100 000 ₽, like real tenders, so busy days overflow one price range
+        return [(f'03{day:%y%m%d}{idx:011d}', int(10 ** rnd.gauss(5, 1))) for idx in range(count)]
+
+    def search(self, query: dict) -> str:
+        price_from, price_to = int(query.get('priceFromGeneral', 0)), int(query.get('priceToGeneral', 10 ** 15))
+        page, per_page = int(query.get('pageNumber', 1)), int(query.get('recordsPerPage', 10))
+        found = [purchase for purchase in self.purchases(query['publishDateFrom']) if price_from <= purchase[1] <= price_to]
+        return search_page(len(found), found[(page - 1) * per_page:page * per_page])
+
+    def card(self, reg_number: str) -> str:
+        number = int(reg_number[-6:])
+        placement_date = datetime.datetime.strptime(reg_number[2:8], '%y%m%d').strftime('%d.%m.%Y')
+        return card_page(reg_number, placement_date, positions=number % (self.max_positions + 1), with_suppliers=number % 3 != 0)
+
+    def suppliers(self, reg_number: str) -> str:
+        return suppliers_page(reg_number, suppliers=1 + int(reg_number[-6:]) % 4)
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    registry: Registry = None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path.startswith(SEARCH_PATH) and 'publishDateFrom' in query:
+            body = self.registry.search(query)
+        elif url.path == CARD_PATH and 'regNumber' in query:
+            body = self.registry.card(query['regNumber'])
+        elif url.path == SUPPLIERS_PATH and 'regNumber' in query:
+            body = self.registry.suppliers(query['regNumber'])
+        else:
+            self.send_error(404)
+            return
+        if self.registry.latency:
+            time.sleep(self.registry.latency)
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = 0, **registry_kwargs) -> ThreadingHTTPServer:
+    handler = type('Handler', (RegistryHandler,), {'registry': Registry(**registry_kwargs)})
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--purchases-per-day', type=int, default=3000)
+    parser.add_argument('--max-positions', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    args = parser.parse_args()
+    server = serve(args.port, purchases_per_day=args.purchases_per_day, max_positions=args.max_positions, latency=args.latency)
+    print(f'Serving on http://127.0.0.1:{server.server_port}{SEARCH_PATH}?morphology=on')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,157 @@
+# Synthetic registry pages shaped like the zakupki.gov.ru markup the spider parses.
+import random
+from typing import List, Tuple
+
+CARD_PAGE = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Закупка № {id}</title></head><body>
+<div class="cardMainInfo">
+<span class="cardMainInfo__purchaseLink distancedText"><a href="/epz/order/notice/ea44/view/common-info.html?regNumber={id}">№ {id}</a></span>
+<div class="sectionMainInfo__body">
+<div class="cardMainInfo__section"><span class="cardMainInfo__title">Объект закупки</span>
+<span class="cardMainInfo__content">{object}</span></div>
+<div class="cardMainInfo__section"><span class="cardMainInfo__title">Заказчик</span>
+<span class="cardMainInfo__content"><a href="#">{customer}</a></span></div>
+</div>
+<div class="date">
+<div class="cardMainInfo__section"><span class="cardMainInfo__title">Размещено</span>
+<span class="cardMainInfo__content"> {placement_date} </span></div>
+<div class="cardMainInfo__section"><span class="cardMainInfo__title">Обновлено</span>
+<span class="cardMainInfo__content"> {placement_date} </span></div>
+<div class="cardMainInfo__section"><span class="cardMainInfo__title">Окончание подачи заявок</span>
+<span class="cardMainInfo__content"> {application_deadline} </span></div>
+</div>
+</div>
+<div class="tabsNav">
+<a class="tabsNav__item tabsNav__item_active" href="/epz/order/notice/ea44/view/common-info.html?regNumber={id}">Общая информация</a>
+<a class="tabsNav__item" href="/epz/order/notice/ea44/view/documents.html?regNumber={id}">Документы</a>
+{supplier_tab}
+</div>
+<div class="blockInfo"><h2 class="blockInfo__title">Общая информация о закупке</h2>
+<section class="blockInfo__section"><span class="section__title">Способ определения поставщика (подрядчика, исполнителя)</span>
+<span class="section__info">Электронный аукцион</span></section>
+<section class="blockInfo__section"><span class="section__title">Наименование электронной площадки в информационно-телекоммуникационной сети «Интернет»</span>
+<span class="section__info">РТС-тендер</span></section>
+</div>
+<div class="blockInfo"><h2 class="blockInfo__title">Контактная информация</h2>
+<section class="blockInfo__section"><span class="section__title">Организация, осуществляющая размещение</span>
+<span class="section__info"> {customer} </span></section>
+<section class="blockInfo__section"><span class="section__title">Почтовый адрес</span>
+<span class="section__info"> 101000, г. Москва </span></section>
+<section class="blockInfo__section"><span class="section__title">Регион</span>
+<span class="section__info"> {region} </span></section>
+</div>
+<div class="blockInfo"><h2 class="blockInfo__title">Начальная (максимальная) цена контракта</h2>
+<section class="blockInfo__section"><span class="section__title">Начальная (максимальная) цена контракта</span>
+<span class="section__info">{start_price} ₽</span></section>
+<section class="blockInfo__section"><span class="section__title">Валюта</span>
+<span class="section__info"> {currency} </span></section>
+</div>
+<div class="blockInfo"><h2 class="blockInfo__title">Информация об объекте закупки</h2>
+<table class="blockInfo__table tableBlock">
+<thead class="tableBlock__head"><tr class="tableBlock__row">
+<th class="tableBlock__col tableBlock__col_header"> </th>
+<th class="tableBlock__col tableBlock__col_header">Код позиции</th>
+<th class="tableBlock__col tableBlock__col_header">Наименование Товара, Работы, Услуги по КТРУ</th>
+<th class="tableBlock__col tableBlock__col_header">Ед. измерения</th>
+<th class="tableBlock__col tableBlock__col_header">Количество</th>
+<th class="tableBlock__col tableBlock__col_header">Цена за ед., ₽</th>
+<th class="tableBlock__col tableBlock__col_header">Стоимость, ₽</th>
+</tr></thead>
+<tbody class="tableBlock__body">
+{positions}
+</tbody></table>
+</div>
+</body></html>'''
+
+POSITION_ROW = '''<tr class="tableBlock__row">
+<td class="tableBlock__col"><span class="chevronRight"></span></td>
+<td class="tableBlock__col">{code}</td>
+<td class="tableBlock__col">{name}
+<br><span class="hint">ТРУ</span></td>
+<td class="tableBlock__col">{unit}</td>
+<td class="tableBlock__col">{quantity}</td>
+<td class="tableBlock__col">{price_per_unit}</td>
+<td class="tableBlock__col">{total_price}</td>
+</tr>'''
+
+# Characteristics sub-table, rendered after the last position only: the row walk stops at the first nested table
+CHARACTERISTICS_ROW = '''<tr class="truInfo_{idx}" style="display: none"><td colspan="7">
+<table class="blockInfo__table tableBlock"><thead class="tableBlock__head"><tr class="tableBlock__row">
+<th class="tableBlock__col">Наименование характеристики</th><th class="tableBlock__col">Значение характеристики</th></tr></thead>
+<tbody class="tableBlock__body"><tr class="tableBlock__row"><td class="tableBlock__col">Тип</td><td class="tableBlock__col">Стандарт</td></tr></tbody>
+</table></td></tr>'''
+
+SUPPLIER_TAB = '<a class="tabsNav__item" href="/epz/order/notice/ea44/view/supplier-results.html?regNumber={id}">Результаты определения поставщика</a>'
+
+SUPPLIERS_PAGE = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"></head><body>
+<div class="blockInfo"><h2 class="blockInfo__title">Результаты определения поставщика</h2>
+<div id="supplier-def-result-participant-table-{id}">
+<table class="blockInfo__table tableBlock">
+<thead class="tableBlock__head"><tr class="tableBlock__row">
+<th class="tableBlock__col tableBlock__col_header">Участник(и), с которыми планируется заключить контракт</th>
+<th class="tableBlock__col tableBlock__col_header">Порядковые номера, полученные по результатам рассмотрения заявок</th>
+<th class="tableBlock__col tableBlock__col_header">Предложения участников, ₽</th>
+</tr></thead>
+<tbody class="tableBlock__body">
+{suppliers}
+</tbody></table></div></div>
+</body></html>'''
+
+SUPPLIER_ROW = '''<tr class="tableBlock__row">
+<td class="tableBlock__col">{name}</td>
+<td class="tableBlock__col">{number}</td>
+<td class="tableBlock__col">{offer}</td>
+</tr>'''
+
+SEARCH_PAGE = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"></head><body>
+<div class="search-results__total">{total}</div>
+{entries}
+</body></html>'''
+
+SEARCH_ENTRY = '''<div class="search-registry-entry-block box-shadow-search-input">
+<div class="row no-gutters registry-entry__form mr-0">
+<div class="registry-entry__header-mid__number"><a href="/epz/order/notice/ea44/view/common-info.html?regNumber={id}" target="_blank">№ {id}</a></div>
+<div class="registry-entry__body-value">{object}</div>
+<div class="price-block__value">{price} ₽</div>
+</div></div>'''
+
+REGIONS = ['Москва', 'Санкт-Петербург', 'Новосибирская обл', 'Свердловская обл', 'Республика Татарстан']
+UNITS = ['Штука', 'Упаковка', 'Килограмм', 'Условная единица', 'Метр']
+
+
+def money(value: float) -> str:
+    return f'{value:,.2f}'.replace(',', ' ').replace('.', ',')
+
+
+def card_page(id: str, placement_date: str, positions: int = 10, with_suppliers: bool = True, seed: int = 0) -> str:
+    rnd = random.Random(seed or id)
+    rows = []
+    start_price = 0.0
+    for idx in range(positions):
+        quantity = rnd.randint(1, 500)
+        price = round(rnd.uniform(10, 50000), 2)
+        start_price += quantity * price
+        rows.append(POSITION_ROW.format(idx=idx, code=f'26.20.{rnd.randint(10, 99)}.{rnd.randint(100, 999)}-{idx:08d}',
+                                        name=f'Товар  {idx}\n   модель {rnd.randint(1, 99)}', unit=rnd.choice(UNITS),
+                                        quantity=quantity, price_per_unit=money(price), total_price=money(quantity * price)))
+    if rows:
+        rows.append(CHARACTERISTICS_ROW.format(idx=positions - 1))
+    return CARD_PAGE.format(id=id, object=f'Поставка\n товаров  для нужд учреждения {id}',
+                            customer=f'ГБУЗ «Городская больница № {rnd.randint(1, 99)}»', region=rnd.choice(REGIONS),
+                            placement_date=placement_date, application_deadline=f'{placement_date} 09:00 (МСК)',
+                            start_price=money(start_price), currency='Российский рубль',
+                            supplier_tab=SUPPLIER_TAB.format(id=id) if with_suppliers else '', positions='\n'.join(rows))
+
+
+def suppliers_page(id: str, suppliers: int = 3, seed: int = 0) -> str:
+    rnd = random.Random(seed or id)
+    rows = [SUPPLIER_ROW.format(name=f'ООО «Поставщик {rnd.randint(1, 9999)}»', number=idx + 1, offer=money(rnd.uniform(1000, 10 ** 6)))
+            for idx in range(suppliers)]
+    return SUPPLIERS_PAGE.format(id=id, suppliers='\n'.join(rows))
+
+
+def search_page(total: int, entries: List[Tuple[str, int]]) -> str:
+    return SEARCH_PAGE.format(total=f'{total:,} записей'.replace(',', ' '),
+                              entries='\n'.join(SEARCH_ENTRY.format(id=id, object=f'Поставка {id}', price=money(price)) for id, price in entries))
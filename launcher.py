@@ -1,22 +1,117 @@
 import argparse
 import os
+import sys
 
 from scrapy.crawler import CrawlerProcess
+from scrapy.utils.log import configure_logging
 from scrapy.utils.project import get_project_settings
 
+from purchases_crawler.purchases_crawler.sharding import run_sharded
+from purchases_crawler.purchases_crawler.storage_files import COMPRESSIONS
 from purchases_crawler.purchases_crawler.spiders.goszakupki.purchase_object_spider import PurchaseObjectSpider
 
 
+def storage_settings(args) -> dict:
+    if args.storage != 'jsonl':
+        return {}
+    return {
+        'ITEM_PIPELINES': {'purchases_crawler.purchases_crawler.pipelines.JsonLinesPipeline': 300},
+        'JSONL_DIR': args.out_dir,
+        'JSONL_COMPRESSION': args.compression,
+        'JSONL_ROTATE_MB': args.rotate_mb,
+    }
+
+
+def cache_settings(args) -> dict:
+    if not (args.http_cache or args.replay):
+        return {}
+    settings = {'HTTPCACHE_ENABLED': True}
+    if args.replay:
+        # Offline: nothing leaves the machine, so there is nothing to throttle either
+        settings.update({'HTTPCACHE_REPLAY': True, 'HTTPCACHE_IGNORE_MISSING': True, 'ADAPTIVE_THROTTLE_ENABLED': False,
+                         'DOWNLOAD_DELAY': 0, 'CONCURRENT_REQUESTS_PER_DOMAIN': 64, 'CONCURRENT_REQUESTS': 64})
+    return settings
+
+
+def telemetry_settings(args) -> dict:
+    settings = {}
+    if args.telemetry_file:
+        settings['TELEMETRY_FILE'] = args.telemetry_file
+    if args.metrics_port:
+        settings['TELEMETRY_PROMETHEUS_PORT'] = args.metrics_port
+    if args.profile:
+        settings['TELEMETRY_PROFILE_STAGES'] = args.profile
+    return settings
+
+
+def archive_settings(args) -> dict:
+    if not args.archive_raw:
+        return {}
+    return {'RAW_ARCHIVE_ENABLED': True, 'RAW_ARCHIVE_DIR': args.archive_raw}
+
+
 def run():
     parser = argparse.ArgumentParser()
     required_named = parser.add_argument_group('required named arguments')
     required_named.add_argument("-u", "--url", help="Start url with search parameters.", required=True)
     parser.add_argument('-cs', '--connection-string', help='Connection string to mongo db', action='store', default='objects')
+    parser.add_argument('-s', '--storage', help='Where purchases are stored: mongo db, compressed JSON Lines files in --out-dir '
+                                                        'or memory (discarded at exit, for dry runs)',
+                        choices=PurchaseObjectSpider.STORAGES, default='mongo')
+    parser.add_argument('-o', '--out-dir', help='Output directory for jsonl storage', action='store', default='output')
+    parser.add_argument('--compression', help='Compression of jsonl output files', choices=COMPRESSIONS, default='gzip')
+    parser.add_argument('--rotate-mb', help='Start a new jsonl file after this many megabytes of uncompressed JSON', type=int, default=256)
+    parser.add_argument('-k', '--known-ids-file', help='Local file with known purchase ids used instead of loading them from mongo db '
+                                                       '(<out-dir>/known_ids.txt by default for jsonl storage)', action='store', default=None)
+    parser.add_argument('-pc', '--partition-cache', help='File with learned price interval layouts per placement date (per search, see --checkpoint-file)', action='store', default='partitions.json')
+    parser.add_argument('-m', '--mode', help='Crawl mode: full (every date back to 2013-04-01), incremental (recent dates and changed partitions), range (--date-from .. --date-to) '
+                             'or enrich (supplier results of stored purchases whose application deadline has passed, mongo storage only)',
+                        choices=PurchaseObjectSpider.MODES, default='full')
+    parser.add_argument('--date-from', help='First placement date to crawl, YYYY-MM-DD', action='store', default=None)
+    parser.add_argument('--date-to', help='Last placement date to crawl, YYYY-MM-DD (today by default)', action='store', default=None)
+    parser.add_argument('--recent-days', help='Incremental mode: dates newer than this are always re-crawled', type=int, default=7)
+    parser.add_argument('--verify-days', help='Incremental mode: finished dates newer than this are re-checked for changed result numbers', type=int, default=90)
+    parser.add_argument('-r', '--resume', help='Skip dates and partitions already finished according to the checkpoint file', action='store_true')
+    parser.add_argument('-cp', '--checkpoint-file', help='SQLite file with finished searches; a hash of the start url filters is added to the name', action='store', default='checkpoints.db')
+    parser.add_argument('-w', '--workers', help='Number of crawler processes, each crawling its own share of placement dates', type=int, default=1)
+    parser.add_argument('--max-restarts', help='How many times a worker process that failed or left dates unfinished is restarted', type=int, default=3)
+    parser.add_argument('--http-cache', help='Keep downloaded pages in the registry cache and reuse them while fresh', action='store_true')
+    parser.add_argument('--replay', help='Crawl from the registry cache only, without network access, and re-parse every '
+                                         'cached card, known or not', action='store_true')
+    parser.add_argument('--telemetry-file', help='Dump stage timings, queue depths and item rates to this JSON file every minute '
+                                                 '(shards add their index to the name)', default=None)
+    parser.add_argument('--metrics-port', help='Serve Prometheus metrics on 127.0.0.1:<port>/metrics (shards use the following ports)', type=int, default=0)
+    parser.add_argument('--profile', help='Profile a sample of the calls of this callback into profile.pstats, may be repeated',
+                        choices=['parse', 'parse_card', 'parse_suppliers'], action='append', default=[])
+    parser.add_argument('--archive-raw', help='Keep the HTML of card and supplier pages in compressed segments in this directory '
+                                              'for reprocess.py', metavar='DIR', default=None)
     args = parser.parse_args()
+    if args.mode == 'range' and not (args.date_from or args.date_to):
+        parser.error('range mode requires --date-from and/or --date-to')
+    if args.mode == 'enrich' and args.storage != 'mongo':
+        parser.error('enrich mode requires mongo storage')
+    if args.workers > 1 and args.checkpoint_file == ':memory:':
+        parser.error('several workers need a shared --checkpoint-file to restart failed shards')
+    if args.storage == 'jsonl' and not args.known_ids_file:
+        os.makedirs(args.out_dir, exist_ok=True)
+        args.known_ids_file = os.path.join(args.out_dir, 'known_ids.txt')
+    spider_kwargs = dict(start_urls=[args.url], connection_string=args.connection_string, storage=args.storage,
+                         known_ids_file=args.known_ids_file, partition_cache=args.partition_cache,
+                         mode=args.mode, date_from=args.date_from, date_to=args.date_to, recent_days=args.recent_days,
+                         verify_days=args.verify_days, resume=args.resume, checkpoint_file=args.checkpoint_file,
+                         reparse=args.replay)
     os.environ['SCRAPY_SETTINGS_MODULE'] = 'purchases_crawler.purchases_crawler.settings'
     settings = get_project_settings()
+    settings_overrides = dict(storage_settings(args), **cache_settings(args), **telemetry_settings(args), **archive_settings(args))
+    settings.setdict(settings_overrides, priority='cmdline')
+    if args.workers > 1:
+        configure_logging(settings)
+        stats = run_sharded(spider_kwargs, args.workers, args.max_restarts, settings_overrides)
+        if stats['shards/failed']:
+            sys.exit(1)
+        return
     crawler_process = CrawlerProcess(settings)
-    crawler_process.crawl(PurchaseObjectSpider, start_urls=[args.url], connection_string=args.connection_string)
+    crawler_process.crawl(PurchaseObjectSpider, **spider_kwargs)
     crawler_process.start()
 
 
@@ -1,13 +1,62 @@
-import json
-from pymongo import MongoClient
+import argparse
+import logging
 
-client = MongoClient('localhost', 27017, username='admin', password='12345')
-db = client['zakupki']
-collection = db['purchases']
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 
-with open('3m/objects.json', encoding='utf-8') as f:
-    file_data = json.load(f)
+from purchases_crawler.purchases_crawler.storage_files import input_files, read_documents, restore_dates
+from purchases_crawler.purchases_crawler.store import PurchaseStore
 
-collection.insert_many(file_data)
 
-client.close()
+def flush(collection, chunk) -> (int, int):
+    requests = [UpdateOne({'id': id}, PurchaseStore.update(document), upsert=True) for id, document in chunk.items()]
+    try:
+        result = collection.bulk_write(requests, ordered=False)
+        return result.upserted_count + result.modified_count, 0
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        for error in errors[:10]:
+            logging.warning(f'Write failed: {error.get("errmsg")}')
+        return e.details.get('nUpserted', 0) + e.details.get('nModified', 0), len(errors)
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Streams crawled purchases (JSON Lines, optionally .gz/.zst, '
+                                                 'or a legacy JSON array file) into mongo db in chunks.')
+    parser.add_argument('paths', nargs='*', default=['3m/objects.json'], help='Files, globs or directories with .jsonl* files')
+    parser.add_argument('-cs', '--connection-string', help='Connection string to mongo db, with the database name and any '
+                                                     'credentials', action='store', default='mongodb://localhost:27017/zakupki')
+    parser.add_argument('-c', '--collection', help='Collection name', action='store', default='purchases')
+    parser.add_argument('--chunk-size', help='Documents per bulk write', type=int, default=1000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+    client = MongoClient(args.connection_string)
+    collection = client.get_database()[args.collection]
+    collection.create_index([("id", 1)], unique=True)
+    written = 0
+    failed = 0
+    try:
+        for path in input_files(args.paths):
+            chunk = {}
+            for document in read_documents(path):
+                document.pop('_id', None)
+                restore_dates(document)
+                # Supplier results patches follow their cards; merging keeps them in order within unordered writes
+                chunk.setdefault(document['id'], {}).update(document)
+                if len(chunk) >= args.chunk_size:
+                    chunk_written, chunk_failed = flush(collection, chunk)
+                    written += chunk_written
+                    failed += chunk_failed
+                    chunk = {}
+            if chunk:
+                chunk_written, chunk_failed = flush(collection, chunk)
+                written += chunk_written
+                failed += chunk_failed
+            logging.info(f'Imported {path}. Written: {written} Failed: {failed}')
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    run()
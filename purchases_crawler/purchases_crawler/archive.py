@@ -0,0 +1,49 @@
+import datetime
+import logging
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from purchases_crawler.purchases_crawler.storage_files import RotatingJsonLinesWriter, zstandard
+
+
+class RawPageArchive:
+    # Keeps the HTML of every downloaded card and supplier results page in compressed JSON Lines segments
+    # under RAW_ARCHIVE_DIR, so extraction fixes can be applied by reprocess.py instead of a re-crawl.
+    # Pages served from the HTTP cache were archived when they were downloaded and are skipped.
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('RAW_ARCHIVE_ENABLED'):
+            raise NotConfigured
+        compression = settings.get('RAW_ARCHIVE_COMPRESSION') or ('zstd' if zstandard is not None else 'gzip')
+        self.writer = RotatingJsonLinesWriter(settings.get('RAW_ARCHIVE_DIR', 'archive'), prefix='pages',
+                                              compression=compression,
+                                              rotate_bytes=settings.getint('RAW_ARCHIVE_SEGMENT_MB', 256) * 1024 * 1024)
+        self.stats = crawler.stats
+        logging.info(f'Archiving raw card and supplier pages in {self.writer.directory} ({compression})')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def response_received(self, response, request, spider):
+        if response.status != 200 or 'cached' in response.flags:
+            return
+        if request.callback == getattr(spider, 'parse_card', None):
+            kind = 'card'
+        elif request.callback == getattr(spider, 'parse_suppliers', None):
+            kind = 'suppliers'
+        else:
+            return
+        partition = request.meta.get('partition')
+        self.writer.write({'kind': kind, 'url': request.url, 'purchase_id': request.cb_kwargs.get('purchase_id'),
+                           'placement_date': partition[0] if partition else None,
+                           'fetched_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                           'body': response.text})
+        self.stats.inc_value(f'archive/{kind}_pages', spider=spider)
+
+    def spider_closed(self, spider):
+        self.writer.close()
@@ -0,0 +1,212 @@
+import datetime
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import urllib.parse
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from twisted.internet import defer
+
+from purchases_crawler.purchases_crawler.telemetry import callback_wrapper
+
+Partition = Tuple[str, int, int]
+# Query parameters the spider sets itself; the rest of the start URL (law, region, purchase stage...) selects what is crawled
+CRAWL_PARAMETERS = ('publishDateFrom', 'publishDateTo', 'priceFromGeneral', 'priceToGeneral', 'pageNumber', 'recordsPerPage')
+
+
+def search_scope(url: str) -> str:
+    parts = urllib.parse.urlparse(url)
+    query = sorted((key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                   if key not in CRAWL_PARAMETERS)
+    search = f'{parts.netloc}{parts.path}?{urllib.parse.urlencode(query)}'
+    return hashlib.blake2b(search.encode('utf-8'), digest_size=4).hexdigest()
+
+
+def scoped_path(path: Optional[str], scope: str) -> Optional[str]:
+    # Checkpoints and partition layouts of one search never apply to another: each start URL gets its own files
+    if not path or path == ':memory:':
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}-{scope}{ext}'
+
+
+class CheckpointStore:
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS searches (
+                placement_date TEXT NOT NULL,
+                price_from INTEGER NOT NULL,
+                price_to INTEGER NOT NULL,
+                page INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                finished_at TEXT NOT NULL,
+                fingerprint TEXT,
+                PRIMARY KEY (placement_date, price_from, price_to, page)
+            );
+            CREATE TABLE IF NOT EXISTS partitions (
+                placement_date TEXT NOT NULL,
+                price_from INTEGER NOT NULL,
+                price_to INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                finished_at TEXT NOT NULL,
+                PRIMARY KEY (placement_date, price_from, price_to)
+            );
+            CREATE TABLE IF NOT EXISTS dates (
+                placement_date TEXT PRIMARY KEY,
+                finished_at TEXT NOT NULL
+            );
+        ''')
+        # Checkpoint files written before search fingerprints were kept
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(searches)')]
+        if 'fingerprint' not in columns:
+            with self.connection:
+                self.connection.execute('ALTER TABLE searches ADD COLUMN fingerprint TEXT')
+
+    def close(self):
+        self.connection.close()
+
+    def page_finished(self, partition: Partition, page: int, total: int, fingerprint: Optional[str] = None):
+        with self.connection:
+            # A page checked by its total only keeps the fingerprint of its last full visit
+            self.connection.execute('INSERT INTO searches (placement_date, price_from, price_to, page, total, finished_at, fingerprint) '
+                                    'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (placement_date, price_from, price_to, page) DO UPDATE '
+                                    'SET total = excluded.total, finished_at = excluded.finished_at, '
+                                    'fingerprint = COALESCE(excluded.fingerprint, fingerprint)',
+                                    (*partition, page, total, self.now(), fingerprint))
+
+    def page_fingerprint(self, partition: Partition, page: int) -> Optional[str]:
+        # Only pages whose partition was finished without failures after the page was visited count:
+        # all cards listed on them were stored
+        row = self.connection.execute('SELECT s.fingerprint FROM searches s JOIN partitions p USING (placement_date, price_from, price_to) '
+                                      'WHERE s.placement_date = ? AND s.price_from = ? AND s.price_to = ? AND s.page = ? '
+                                      'AND p.finished_at >= s.finished_at',
+                                      (*partition, page)).fetchone()
+        return row[0] if row else None
+
+    def partition_finished(self, partition: Partition, total: int):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO partitions VALUES (?, ?, ?, ?, ?)',
+                                    (*partition, total, self.now()))
+
+    def date_finished(self, placement_date: str):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO dates VALUES (?, ?)', (placement_date, self.now()))
+
+    def date_unfinished(self, placement_date: str):
+        with self.connection:
+            self.connection.execute('DELETE FROM dates WHERE placement_date = ?', (placement_date,))
+
+    def is_date_finished(self, placement_date: str) -> bool:
+        row = self.connection.execute('SELECT 1 FROM dates WHERE placement_date = ?', (placement_date,)).fetchone()
+        return row is not None
+
+    def partition_total(self, partition: Partition) -> Optional[int]:
+        row = self.connection.execute('SELECT total FROM partitions WHERE placement_date = ? AND price_from = ? AND price_to = ?',
+                                      partition).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def now() -> str:
+        return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def search_fingerprint(total: int, reg_numbers: Iterable[str]) -> str:
+    # Independent of the row order, which the registry does not keep stable between visits
+    digest = hashlib.blake2b('\n'.join(sorted(reg_numbers)).encode('utf-8'), digest_size=16).hexdigest()
+    return f'{total}:{digest}'
+
+
+class CrawlProgress:
+    # Counts outstanding requests (search pages, cards, supplier pages) per partition, so a partition and
+    # then its whole placement date are checkpointed only after every request spawned for them is done.
+    def __init__(self, store: CheckpointStore):
+        self.store = store
+        self.pending: Dict[Partition, int] = {}
+        self.totals: Dict[Partition, int] = {}
+        self.split: Set[Partition] = set()
+        self.date_partitions: Dict[str, int] = {}
+        self.failed_dates: Set[str] = set()
+        # Set by the storage pipeline: returns a Deferred firing with True once every item passed to it so far is
+        # written, False if a write failed meanwhile. Checkpoints wait for it, so a crash cannot skip unwritten purchases.
+        # Writes that fail before that are reported to writes_failed.
+        self.barrier: Optional[Callable[[], defer.Deferred]] = None
+        self.unwritten_dates: Set[str] = set()
+
+    def started(self, partition: Partition):
+        if partition not in self.pending:
+            self.pending[partition] = 0
+            self.date_partitions[partition[0]] = self.date_partitions.get(partition[0], 0) + 1
+        self.pending[partition] += 1
+
+    def page_finished(self, partition: Partition, page: int, total: int, fingerprint: Optional[str] = None):
+        self.totals[partition] = total
+        self.store.page_finished(partition, page, total, fingerprint)
+
+    def partition_split(self, partition: Partition):
+        self.split.add(partition)
+
+    def finished(self, partition: Partition, failed: bool = False):
+        placement_date = partition[0]
+        if failed:
+            self.failed_dates.add(placement_date)
+        self.pending[partition] -= 1
+        if self.pending[partition] > 0:
+            return
+        del self.pending[partition]
+        total = self.totals.pop(partition, None)
+        writes = []
+        if partition not in self.split and total is not None and placement_date not in self.failed_dates:
+            writes.append(functools.partial(self.store.partition_finished, partition, total))
+        self.split.discard(partition)
+        self.date_partitions[placement_date] -= 1
+        if self.date_partitions[placement_date] == 0:
+            del self.date_partitions[placement_date]
+            if placement_date in self.failed_dates:
+                logging.warning(f'Placement date left unfinished after failed requests: {placement_date}')
+                self.failed_dates.discard(placement_date)
+            else:
+                writes.append(functools.partial(self.date_finished, placement_date))
+        if writes:
+            self.checkpoint(writes, placement_date)
+
+    def checkpoint(self, writes: List[Callable[[], None]], placement_date: str):
+        if self.barrier is None:
+            self.items_written(True, writes, placement_date)
+        else:
+            self.barrier().addCallback(self.items_written, writes, placement_date)
+
+    def writes_failed(self):
+        # Lost documents belong to a date still being crawled or to one waiting for its barrier, which fails as well
+        self.unwritten_dates.update(self.date_partitions)
+
+    def items_written(self, written: bool, writes: List[Callable[[], None]], placement_date: str):
+        if not written:
+            self.unwritten_dates.add(placement_date)
+        if placement_date in self.unwritten_dates:
+            logging.warning(f'Placement date left unfinished after failed writes: {placement_date}')
+            return
+        for write in writes:
+            write()
+
+    def date_finished(self, placement_date: str):
+        self.store.date_finished(placement_date)
+        logging.info(f'Placement date finished: {placement_date}')
+
+
+def tracked(callback):
+    def wrapper(spider, response, *args, **kwargs):
+        failed = False
+        try:
+            yield from callback(spider, response, *args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # Enrich requests revisit stored purchases and belong to no search partition
+            if response.meta['partition'] is not None:
+                spider.progress.finished(response.meta['partition'], failed=failed)
+    return callback_wrapper(wrapper, callback)
@@ -0,0 +1,172 @@
+import datetime
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+import urllib.parse
+import zlib
+from typing import Optional
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+from w3lib.url import canonicalize_url
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers BLOB NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    body_hash TEXT NOT NULL,
+    search INTEGER NOT NULL,
+    placement_date TEXT,
+    stored_at REAL NOT NULL,
+    changed_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+'''
+
+
+def cache_key(url: str) -> str:
+    # Registry pages are identified by the tab path and regNumber; tracking and view parameters
+    # around them do not change the content, so they are left out of the key
+    parts = urllib.parse.urlparse(url)
+    query = dict(urllib.parse.parse_qsl(parts.query))
+    if 'regNumber' in query:
+        return f'{parts.netloc}{parts.path}?regNumber={query["regNumber"]}'
+    return canonicalize_url(url)
+
+
+def body_hash(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class RegistryCacheStorage:
+    # HTTPCACHE_STORAGE backend: one SQLite file with zlib-compressed bodies and content hashes.
+    # Card and supplier pages of long-closed placement dates rarely change and live longer in the cache;
+    # search pages expire quickly. The least recently used pages are evicted above HTTPCACHE_MAX_MB.
+    # Shards share the file: every statement commits on its own, so no shard holds the write lock for long,
+    # and a page that cannot be read or written in time is a cache miss rather than a failed request.
+    EVICT_EVERY = 5000
+    BUSY_TIMEOUT = 30.0
+
+    def __init__(self, settings):
+        # Relative to the working directory, like the checkpoint and partition cache files
+        os.makedirs(settings['HTTPCACHE_DIR'], exist_ok=True)
+        self.path = os.path.join(settings['HTTPCACHE_DIR'], 'registry.sqlite')
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.search_expiration_secs = settings.getint('HTTPCACHE_SEARCH_EXPIRATION_SECS', 3600)
+        self.old_page_days = settings.getint('HTTPCACHE_OLD_PAGE_DAYS', 90)
+        self.old_page_expiration_secs = settings.getint('HTTPCACHE_OLD_PAGE_EXPIRATION_SECS', 30 * 24 * 3600)
+        self.max_bytes = settings.getint('HTTPCACHE_MAX_MB', 0) * 1024 * 1024
+        self.replay = settings.getbool('HTTPCACHE_REPLAY')
+        self.ban_markers = [marker.encode('utf-8') for marker in settings.getlist('ADAPTIVE_THROTTLE_BAN_MARKERS')]
+        self.connection = None
+        self.stats = None
+        self.stored = 0
+
+    def open_spider(self, spider):
+        self.connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # Losing the last commits on power loss only costs re-downloads; no fsync per page
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.stats = spider.crawler.stats
+        logging.info(f'Using registry cache storage in {self.path}{" (replay)" if self.replay else ""}')
+
+    def close_spider(self, spider):
+        try:
+            self.evict()
+        except sqlite3.OperationalError as e:
+            logging.warning(f'Registry cache eviction failed: {e}')
+        self.connection.close()
+
+    def expiration(self, search: bool, placement_date: Optional[str]) -> int:
+        # 0 means the page never expires, like HTTPCACHE_EXPIRATION_SECS
+        if self.replay:
+            return 0
+        if search:
+            return self.search_expiration_secs
+        if placement_date:
+            age = datetime.datetime.now() - datetime.datetime.strptime(placement_date, '%d.%m.%Y')
+            if age.days > self.old_page_days:
+                return self.old_page_expiration_secs
+        return self.expiration_secs
+
+    def retrieve_response(self, spider, request):
+        try:
+            return self.retrieve(request)
+        except sqlite3.OperationalError as e:
+            self.failed(spider, request, e)
+            return None
+
+    def retrieve(self, request):
+        key = cache_key(request.url)
+        row = self.connection.execute('SELECT url, status, headers, body, search, placement_date, stored_at '
+                                      'FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body, search, placement_date, stored_at = row
+        expiration = self.expiration(bool(search), placement_date)
+        if 0 < expiration < time.time() - stored_at:
+            return None
+        self.connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        headers = Headers(headers_raw_to_dict(headers))
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=status, body=zlib.decompress(body))
+
+    def store_response(self, spider, request, response):
+        if any(marker in response.body for marker in self.ban_markers):
+            return
+        try:
+            self.store(spider, request, response)
+        except sqlite3.OperationalError as e:
+            self.failed(spider, request, e)
+
+    def store(self, spider, request, response):
+        key = cache_key(request.url)
+        digest = body_hash(response.body)
+        now = time.time()
+        row = self.connection.execute('SELECT body_hash FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is not None and row[0] == digest:
+            self.stats.inc_value('httpcache/unchanged', spider=spider)
+            self.connection.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+            return
+        partition = request.meta.get('partition')
+        body = zlib.compress(response.body, 6)
+        self.connection.execute('INSERT OR REPLACE INTO responses (key, url, status, headers, body, size, body_hash, search, '
+                                'placement_date, stored_at, changed_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                (key, response.url, response.status, headers_dict_to_raw(response.headers), body, len(body),
+                                 digest, int(request.callback == getattr(spider, 'parse', None)),
+                                 partition[0] if partition else None, now, now, now))
+        self.stored += 1
+        if self.max_bytes and self.stored % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def failed(self, spider, request, error: Exception):
+        logging.warning(f'Registry cache unavailable, treated as a miss: {error} URL: {request.url}')
+        self.stats.inc_value('httpcache/errors', spider=spider)
+
+    def evict(self):
+        if not self.max_bytes:
+            return
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Free a tenth more than needed, so eviction does not run again right after the next few stores
+        excess = total - self.max_bytes * 0.9
+        keys = []
+        for key, size in self.connection.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany('DELETE FROM responses WHERE key = ?', keys)
+        logging.info(f'Evicted {len(keys)} least recently used pages from the registry cache')
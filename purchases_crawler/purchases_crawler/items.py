@@ -2,12 +2,90 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
+import datetime
+import re
 from dataclasses import dataclass
+from typing import List, NamedTuple, Optional
 
-import scrapy
+date_pattern = re.compile(r'(\d{2})\.(\d{2})\.(\d{4})(?:\s+(\d{2}):(\d{2}))?')
+
+# suppliers_status of stored purchases: no supplier results tab, results not fetched yet, results stored
+SUPPLIERS_NONE = 'none'
+SUPPLIERS_PENDING = 'pending'
+SUPPLIERS_DONE = 'done'
+
+
+class InvalidPurchase(ValueError):
+    # A card page that is no purchase card, e.g. a maintenance page served with status 200
+    pass
+
+
+def parse_date(value: Optional[str]) -> Optional[datetime.datetime]:
+    # Registry dates look like '01.02.2021' or '01.02.2021 09:00 (МСК)'; times are Moscow time
+    match = date_pattern.search(value or '')
+    if match is None:
+        return None
+    day, month, year, hour, minute = match.groups()
+    try:
+        return datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0))
+    except ValueError:
+        return None
+
+
+# Table rows are tuples: hundreds of positions per card cost a fraction of the memory of one dict each
+class PurchasePosition(NamedTuple):
+    code: Optional[str] = None
+    name: Optional[str] = None
+    unit: Optional[str] = None
+    quantity: Optional[float] = None
+    price_per_unit: Optional[float] = None
+    total_price: Optional[float] = None
+
+
+class Supplier(NamedTuple):
+    name: Optional[str] = None
+    number: Optional[str] = None
+    offer: Optional[float] = None
 
 
 @dataclass
-class PurchaseItem(scrapy.Item):
+class PurchaseItem:
+    __slots__ = ('id', 'url', 'object', 'customer', 'placement_date', 'application_deadline', 'region', 'start_price',
+                 'currency', 'purchase_positions', 'suppliers_status', 'suppliers_url')
     id: str
+    url: str
     object: str
+    customer: Optional[str]
+    placement_date: Optional[datetime.datetime]
+    application_deadline: Optional[datetime.datetime]
+    region: Optional[str]
+    start_price: Optional[float]
+    currency: Optional[str]
+    purchase_positions: List[PurchasePosition]
+    suppliers_status: Optional[str]
+    suppliers_url: Optional[str]
+
+    def __post_init__(self):
+        if not self.id:
+            raise InvalidPurchase(f'Purchase card without registry number: {self.url}')
+
+    def as_document(self) -> dict:
+        # The only conversion to plain types, done once at the storage boundary
+        document = {name: getattr(self, name) for name in self.__slots__}
+        document['purchase_positions'] = [position._asdict() for position in self.purchase_positions]
+        if self.suppliers_url is None:
+            del document['suppliers_url']
+        return document
+
+
+@dataclass
+class SuppliersPatch:
+    # Supplier results fetched after the card was stored; updates only these fields of the stored purchase
+    __slots__ = ('id', 'suppliers', 'suppliers_status')
+    id: str
+    suppliers: List[Supplier]
+    suppliers_status: str
+
+    def as_document(self) -> dict:
+        return {'id': self.id, 'suppliers': [supplier._asdict() for supplier in self.suppliers],
+                'suppliers_status': self.suppliers_status}
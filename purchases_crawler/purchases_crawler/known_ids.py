@@ -0,0 +1,134 @@
+import bisect
+import heapq
+import logging
+import os
+from array import array
+from typing import Iterable, List, Optional
+
+MAX_PACKED_ID = 2 ** 64
+
+
+class FileIdStore:
+    # Shards append to the same file: every id is one unbuffered O_APPEND write of a whole line,
+    # so lines of different processes never interleave
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = None
+
+    def load(self) -> Iterable[str]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+    def add(self, id: str):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self.fd, (id + '\n').encode('utf-8'))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class KnownIdIndex:
+    # Registry numbers are digit strings (often with leading zeros), so they are packed as int('1' + id)
+    # into sorted arrays of unsigned 64-bit integers, 8 bytes per id. Ids added during the crawl collect in a
+    # set of keys that becomes a new sorted run every RUN_SIZE ids; runs of similar size are merged, so a
+    # backfill into an empty store keeps a few runs instead of tens of millions of strings. Ids that do not
+    # fit go to a plain set. Without a store the ids are loaded from the purchase store (see
+    # PurchaseStore.load_ids) and added ones need no persisting, since the pipeline stores the documents.
+    # With a store, added ids are persisted by the storage pipeline (take_unsaved, then save) only once their
+    # documents are written, so a killed crawl never leaves an id behind whose purchase was lost.
+    RUN_SIZE = 100000
+
+    def __init__(self, store=None):
+        self.store = store
+        self.runs: List[array] = []
+        self.recent = set()
+        self.extra = set()
+        self.unsaved = []
+        if store is not None:
+            self.load(store.load())
+
+    def load(self, ids: Iterable[str]):
+        # Sorted in runs of RUN_SIZE keys and merged into one array, never holding every id as a Python object
+        runs = []
+        keys = []
+        for id in ids:
+            key = self.pack(id)
+            if key is None:
+                self.extra.add(id)
+                continue
+            keys.append(key)
+            if len(keys) >= self.RUN_SIZE:
+                runs.append(self.sorted_run(keys))
+                keys = []
+        if keys:
+            runs.append(self.sorted_run(keys))
+        self.runs = [array('Q', heapq.merge(*runs))] if len(runs) > 1 else runs
+        logging.info(f'Known ids loaded: {len(self)}')
+
+    @staticmethod
+    def sorted_run(keys) -> array:
+        return array('Q', sorted(keys))
+
+    @staticmethod
+    def pack(id: str) -> Optional[int]:
+        if not id.isdigit():
+            return None
+        key = int('1' + id)
+        return key if key < MAX_PACKED_ID else None
+
+    def __contains__(self, id: str) -> bool:
+        key = self.pack(id)
+        if key is None:
+            return id in self.extra
+        if key in self.recent:
+            return True
+        for run in self.runs:
+            idx = bisect.bisect_left(run, key)
+            if idx < len(run) and run[idx] == key:
+                return True
+        return False
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs) + len(self.recent) + len(self.extra)
+
+    def add(self, id: str):
+        if not id or id in self:
+            return
+        key = self.pack(id)
+        if key is None:
+            self.extra.add(id)
+        else:
+            self.recent.add(key)
+            if len(self.recent) >= self.RUN_SIZE:
+                self.compact()
+        if self.store is not None:
+            self.unsaved.append(id)
+
+    def compact(self):
+        # Like a binary counter: a run is merged into the previous one while that is less than twice its size,
+        # so every key is merged O(log n) times and lookups bisect O(log n) runs
+        self.runs.append(self.sorted_run(self.recent))
+        self.recent.clear()
+        while len(self.runs) > 1 and len(self.runs[-2]) < 2 * len(self.runs[-1]):
+            last = self.runs.pop()
+            self.runs[-1] = array('Q', heapq.merge(self.runs[-1], last))
+
+    def take_unsaved(self) -> List[str]:
+        ids, self.unsaved = self.unsaved, []
+        return ids
+
+    def save(self, ids: List[str]):
+        for id in ids:
+            self.store.add(id)
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
@@ -2,13 +2,17 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
+import random
+import re
 from time import sleep
+from typing import Optional
 
 from scrapy import signals
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.utils.httpobj import urlparse_cached
 from scrapy.utils.response import response_status_message
 
 
@@ -67,3 +71,131 @@ class PurchasesCrawlerDownloaderMiddleware(RetryMiddleware):
             return self._retry(request, reason, spider) or response
 
         return response
+
+
+class ThrottleBudget:
+    # Per-slot controller: multiplicative backoff with jitter on errors and ban pages,
+    # additive concurrency increase and delay decay while latency stays under the target.
+    EWMA_WEIGHT = 0.1
+
+    def __init__(self, name, min_delay, max_delay, start_delay, max_concurrency, start_concurrency, target_latency):
+        self.name = name
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.delay = start_delay
+        self.concurrency = start_concurrency
+        self.latency = None
+        self.error_rate = 0.0
+        self.ban_rate = 0.0
+        self.successes = 0
+
+    def observe(self, latency=None, error=False, ban=False) -> Optional[str]:
+        if latency is not None:
+            self.latency = latency if self.latency is None else self.latency + self.EWMA_WEIGHT * (latency - self.latency)
+        self.error_rate += self.EWMA_WEIGHT * (float(error) - self.error_rate)
+        self.ban_rate += self.EWMA_WEIGHT * (float(ban) - self.ban_rate)
+        if error or ban:
+            self.successes = 0
+            self.delay = min(self.max_delay, max(self.delay * 2, self.min_delay, 0.5) * random.uniform(0.8, 1.2))
+            self.concurrency = max(1, self.concurrency // 2)
+            return 'ban page' if ban else 'error response'
+        self.successes += 1
+        if self.latency is not None and self.latency > self.target_latency:
+            if self.concurrency > 1:
+                self.concurrency -= 1
+                return 'latency above target'
+            return None
+        # Speed up only after a run of healthy responses, at most one step per concurrency's worth of them
+        if self.successes < self.concurrency * 5:
+            return None
+        self.successes = 0
+        if self.delay > self.min_delay:
+            self.delay = max(self.min_delay, self.delay * 0.75)
+            return 'healthy responses'
+        if self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+            return 'healthy responses'
+        return None
+
+
+class AdaptiveThrottleMiddleware(RetryMiddleware):
+    def __init__(self, crawler):
+        super().__init__(crawler.settings)
+        settings = crawler.settings
+        # Replaces the stock RetryMiddleware, so with throttling disabled it still retries
+        self.enabled = settings.getbool('ADAPTIVE_THROTTLE_ENABLED')
+        self.crawler = crawler
+        self.target_latency = settings.getfloat('ADAPTIVE_THROTTLE_TARGET_LATENCY', 2.0)
+        self.budget_settings = settings.getdict('ADAPTIVE_THROTTLE_BUDGETS')
+        self.search_pattern = re.compile(settings.get('ADAPTIVE_THROTTLE_SEARCH_PATTERN', r'publishDateFrom='))
+        self.ban_statuses = set(settings.getlist('ADAPTIVE_THROTTLE_BAN_STATUSES', [403, 429]))
+        self.ban_markers = [marker.encode('utf-8') for marker in settings.getlist('ADAPTIVE_THROTTLE_BAN_MARKERS')]
+        self.budgets = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def budget_name(self, request) -> str:
+        return 'search' if self.search_pattern.search(request.url) else 'card'
+
+    def process_request(self, request, spider):
+        if not self.enabled or 'download_slot' in request.meta:
+            return None
+        name = self.budget_name(request)
+        request.meta['download_slot'] = f'{urlparse_cached(request).hostname}/{name}'
+        downloader = self.crawler.engine.downloader
+        if request.meta['download_slot'] not in downloader.slots:
+            _, slot = downloader._get_slot(request, spider)
+            budget = self.budget(request.meta['download_slot'], name)
+            slot.concurrency = budget.concurrency
+            slot.delay = budget.delay
+        return None
+
+    def process_response(self, request, response, spider):
+        if not self.enabled:
+            return super().process_response(request, response, spider)
+        if 'cached' in response.flags:
+            return response
+        ban = response.status in self.ban_statuses or any(marker in response.body for marker in self.ban_markers)
+        error = not ban and response.status in self.retry_http_codes
+        self.observe(request, spider, request.meta.get('download_latency'), error, ban)
+        if ban or error:
+            reason = 'ban page' if ban and response.status == 200 else response_status_message(response.status)
+            return self._retry(request, reason, spider) or response
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if self.enabled:
+            self.observe(request, spider, None, True, False)
+        return super().process_exception(request, exception, spider)
+
+    def budget(self, slot_key: str, name: str) -> ThrottleBudget:
+        if slot_key not in self.budgets:
+            limits = self.budget_settings.get(name, {})
+            self.budgets[slot_key] = ThrottleBudget(slot_key, limits.get('min_delay', 0.1), limits.get('max_delay', 60.0),
+                                                    limits.get('start_delay', 1.0), limits.get('max_concurrency', 4),
+                                                    limits.get('start_concurrency', 1), self.target_latency)
+        return self.budgets[slot_key]
+
+    def observe(self, request, spider, latency, error, ban):
+        slot_key = request.meta.get('download_slot')
+        if slot_key is None:
+            return
+        budget = self.budget(slot_key, self.budget_name(request))
+        reason = budget.observe(latency, error, ban)
+        slot = self.crawler.engine.downloader.slots.get(slot_key)
+        if slot is not None:
+            slot.concurrency = budget.concurrency
+            slot.delay = budget.delay
+        stats = self.crawler.stats
+        stats.set_value(f'throttle/{slot_key}/concurrency', budget.concurrency, spider=spider)
+        stats.set_value(f'throttle/{slot_key}/delay', round(budget.delay, 3), spider=spider)
+        if ban:
+            stats.inc_value(f'throttle/{slot_key}/bans', spider=spider)
+        if reason:
+            latency_text = f'{budget.latency:.2f}s' if budget.latency is not None else '-'
+            spider.logger.info(f'Throttle {slot_key}: concurrency {budget.concurrency} delay {budget.delay:.2f}s '
+                               f'(latency {latency_text}, errors {budget.error_rate:.0%}, bans {budget.ban_rate:.0%}, reason: {reason})')
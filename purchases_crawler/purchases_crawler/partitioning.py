@@ -0,0 +1,165 @@
+import bisect
+import fcntl
+import json
+import logging
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+PriceRange = Tuple[int, int]
+
+
+class PricePartitionPlanner:
+    # Price axis is bucketed in log10(price + 1) space, BINS_PER_DECADE buckets per decade
+    BINS_PER_DECADE = 4
+    MAX_DECADES = 16
+    # Every bucket gets this weight on top of the observed counts so unseen ranges still get split
+    PRIOR_WEIGHT = 1.0
+
+    def __init__(self, default_intervals: List[PriceRange], max_items: int, cache_file: Optional[str] = None,
+                 fill_ratio: float = 0.5):
+        self.default_intervals = list(default_intervals)
+        self.max_items = max_items
+        self.cache_file = cache_file
+        self.fill_ratio = fill_ratio
+        self.layouts: Dict[str, Dict[PriceRange, Optional[int]]] = {}
+        self.histogram = [0.0] * (self.BINS_PER_DECADE * self.MAX_DECADES)
+        # Several crawl processes may share one cache file: only the dates changed here and the
+        # histogram increase since loading are merged into it on save.
+        self.saved_histogram = list(self.histogram)
+        self.changed_dates = set()
+        self.load()
+
+    def load(self):
+        if not self.cache_file:
+            return
+        self.layouts, histogram = self.read_cache()
+        if histogram:
+            self.histogram = histogram
+            self.saved_histogram = list(histogram)
+        logging.info(f'Partition layouts loaded: {len(self.layouts)} dates')
+
+    def read_cache(self) -> (Dict[str, Dict[PriceRange, Optional[int]]], List[float]):
+        if not os.path.exists(self.cache_file):
+            return {}, []
+        with open(self.cache_file, encoding='utf-8') as f:
+            data = json.load(f)
+        layouts = {placement_date: {(price_from, price_to): count for price_from, price_to, count in intervals}
+                   for placement_date, intervals in data.get('layouts', {}).items()}
+        histogram = data.get('histogram', [])
+        return layouts, histogram if len(histogram) == len(self.histogram) else []
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with open(self.cache_file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            layouts, histogram = self.read_cache()
+            for placement_date in self.changed_dates:
+                layouts[placement_date] = self.layouts[placement_date]
+            if histogram:
+                histogram = [stored + current - saved for stored, current, saved in zip(histogram, self.histogram, self.saved_histogram)]
+            else:
+                histogram = self.histogram
+            data = {
+                'layouts': {placement_date: [[price_from, price_to, count] for (price_from, price_to), count in sorted(layout.items())]
+                            for placement_date, layout in layouts.items()},
+                'histogram': histogram,
+            }
+            tmp_file = self.cache_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self.cache_file)
+        self.layouts = layouts
+        self.histogram = histogram
+        self.saved_histogram = list(histogram)
+        self.changed_dates.clear()
+
+    def intervals(self, placement_date: str) -> List[PriceRange]:
+        layout = self.layouts.get(placement_date)
+        if not layout:
+            return self.default_intervals.copy()
+        return sorted(layout)
+
+    def record(self, placement_date: str, price_range: PriceRange, count: int):
+        layout = self.layouts.setdefault(placement_date, {})
+        self.changed_dates.add(placement_date)
+        known_count = layout.get(price_range)
+        layout[price_range] = count
+        if count <= self.max_items:
+            self.add_to_histogram(price_range, count - (known_count or 0))
+
+    def split(self, placement_date: str, price_range: PriceRange, count: int) -> List[PriceRange]:
+        price_from, price_to = price_range
+        parts = max(2, math.ceil(count / (self.max_items * self.fill_ratio)))
+        parts = min(parts, price_to - price_from + 1)
+        cuts = self.quantile_cuts(price_range, parts)
+        intervals = []
+        lower = price_from
+        for cut in cuts:
+            intervals.append((lower, cut))
+            lower = cut + 1
+        intervals.append((lower, price_to))
+        layout = self.layouts.setdefault(placement_date, {})
+        self.changed_dates.add(placement_date)
+        layout.pop(price_range, None)
+        for interval in intervals:
+            layout.setdefault(interval, None)
+        return intervals
+
+    def quantile_cuts(self, price_range: PriceRange, parts: int) -> List[int]:
+        price_from, price_to = price_range
+        bounds, weights = self.weights(price_range)
+        total = sum(weights)
+        cumulative = []
+        running = 0.0
+        for weight in weights:
+            running += weight
+            cumulative.append(running)
+        cuts = []
+        for part in range(1, parts):
+            target = total * part / parts
+            idx = min(bisect.bisect_left(cumulative, target), len(weights) - 1)
+            before = cumulative[idx - 1] if idx > 0 else 0.0
+            fraction = (target - before) / weights[idx] if weights[idx] else 0.0
+            position = bounds[idx][0] + fraction * (bounds[idx][1] - bounds[idx][0])
+            cut = int(round(10 ** position - 1))
+            lowest = cuts[-1] + 1 if cuts else price_from
+            # The last price is always left for the upper part; a cut at price_from is valid whenever the
+            # range holds two prices, so even the narrowest range is split
+            if lowest >= price_to:
+                break
+            cuts.append(min(max(cut, lowest), price_to - 1))
+        return cuts
+
+    def weights(self, price_range: PriceRange) -> (List[Tuple[float, float]], List[float]):
+        low, high = self.log_price(price_range[0]), self.log_price(price_range[1] + 1)
+        bounds = []
+        weights = []
+        for idx, weight in enumerate(self.histogram):
+            bin_low, bin_high = idx / self.BINS_PER_DECADE, (idx + 1) / self.BINS_PER_DECADE
+            overlap_low, overlap_high = max(low, bin_low), min(high, bin_high)
+            if overlap_high <= overlap_low:
+                continue
+            overlap = (overlap_high - overlap_low) * self.BINS_PER_DECADE
+            bounds.append((overlap_low, overlap_high))
+            weights.append(overlap * (weight + self.PRIOR_WEIGHT))
+        if not weights:
+            bounds.append((low, high))
+            weights.append(1.0)
+        return bounds, weights
+
+    def add_to_histogram(self, price_range: PriceRange, count: int):
+        if count == 0:
+            return
+        low, high = self.log_price(price_range[0]), self.log_price(price_range[1] + 1)
+        width = high - low
+        for idx in range(int(low * self.BINS_PER_DECADE), min(math.ceil(high * self.BINS_PER_DECADE), len(self.histogram))):
+            bin_low, bin_high = idx / self.BINS_PER_DECADE, (idx + 1) / self.BINS_PER_DECADE
+            overlap = min(high, bin_high) - max(low, bin_low)
+            if overlap > 0:
+                self.histogram[idx] += count * overlap / width
+
+    @staticmethod
+    def log_price(price: int) -> float:
+        return math.log10(price + 1)
@@ -6,23 +6,185 @@
 
 # useful for handling different item types with a single interface
 import json
+import logging
 
-from itemadapter import ItemAdapter
-from pymongo import MongoClient
 from ruamel import yaml
 from scrapy.exporters import JsonItemExporter
+from twisted.internet import defer, task
+
+from purchases_crawler.purchases_crawler.storage_files import RotatingJsonLinesWriter
+
+
+def save_known_ids(written: bool, known_ids, ids) -> bool:
+    # Ids are persisted only with their documents, otherwise later runs would skip purchases that were never stored
+    if written:
+        known_ids.save(ids)
+    return written
 
 
 class PurchasesCrawlerPipeline:
 
     def open_spider(self, spider):
-        self.client = spider.client
-        self.collection = self.client.get_database()['purchases']
-        self.collection.create_index([("id", 1)], unique=True)
+        self.store = spider.store
+        self.known_ids = spider.known_ids
+        self.progress = spider.progress
+        self.pending = set()
+        self.failed = 0
+        spider.progress.barrier = self.barrier
+        return self.store.ensure_indexes()
+
+    def close_spider(self, spider):
+        return self.barrier()
+
+    def process_item(self, item, spider):
+        # Supplier results arrive as a patch of an already stored card
+        d = self.store.upsert([item.as_document()])
+        spider.known_ids.add(item.id)
+        self.pending.add(d)
+        d.addBoth(self.written, d)
+        d.addCallback(lambda _: item)
+        return d
+
+    def written(self, result, d):
+        self.pending.discard(d)
+        if not isinstance(result, tuple) or result[2]:
+            self.failed += 1
+            self.progress.writes_failed()
+        return result
+
+    def barrier(self) -> defer.Deferred:
+        # Answers for the writes pending now; earlier failures went to CrawlProgress.writes_failed
+        ids = self.known_ids.take_unsaved()
+        failed = self.failed
+        d = defer.DeferredList(list(self.pending))
+        d.addCallback(lambda _: self.failed == failed)
+        d.addCallback(save_known_ids, self.known_ids, ids)
+        return d
+
+
+class BatchedMongoPipeline:
+    def __init__(self, stats, batch_size=500, flush_interval=5.0):
+        self.stats = stats
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batch = {}
+        self.pending = set()
+        self.flushed = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats,
+                   batch_size=crawler.settings.getint('MONGO_BATCH_SIZE', 500),
+                   flush_interval=crawler.settings.getfloat('MONGO_FLUSH_INTERVAL', 5.0))
+
+    def open_spider(self, spider):
+        self.store = spider.store
+        self.known_ids = spider.known_ids
+        self.progress = spider.progress
+        spider.progress.barrier = self.barrier
+        self.flush_loop = task.LoopingCall(self.flush)
+        self.flush_loop.start(self.flush_interval, now=False)
+        return self.store.ensure_indexes()
 
     def close_spider(self, spider):
-        self.client.close()
+        if self.flush_loop.running:
+            self.flush_loop.stop()
+        d = self.barrier()
+        d.addBoth(self.closed)
+        return d
+
+    def closed(self, _):
+        logging.info(f'Mongo batches written. Flushed: {self.flushed} Duplicates: {self.duplicates} Failed: {self.failed}')
+
+    def process_item(self, item, spider):
+        # A card and its supplier results patch can meet in one batch; they are merged, because an
+        # unordered bulk write could apply the patch before the card
+        self.batch.setdefault(item.id, {}).update(item.as_document())
+        spider.known_ids.add(item.id)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        if self.store.saturated:
+            # Held items stay in the scraper slot, and a full scraper slot stops the engine from
+            # scheduling more downloads until the writes catch up
+            self.stats.inc_value('mongo/backpressure')
+            d = self.store.capacity()
+            d.addCallback(lambda _: item)
+            return d
+        return item
+
+    def flush(self):
+        if not self.batch:
+            return None
+        batch, self.batch = list(self.batch.values()), {}
+        d = self.store.upsert(batch)
+        d.addCallbacks(self.batch_written, self.batch_failed, errbackArgs=(len(batch),))
+        self.pending.add(d)
+        d.addBoth(self.release, d)
+        return d
+
+    def barrier(self) -> defer.Deferred:
+        # Checkpoints wait for the items buffered so far, so they are flushed right away. Answers for the writes
+        # pending now; earlier failures went to CrawlProgress.writes_failed.
+        ids = self.known_ids.take_unsaved()
+        self.flush()
+        failed = self.failed
+        d = defer.DeferredList(list(self.pending))
+        d.addCallback(lambda _: self.failed == failed)
+        d.addCallback(save_known_ids, self.known_ids, ids)
+        return d
+
+    def release(self, result, d):
+        self.pending.discard(d)
+        return result
+
+    def batch_written(self, counts):
+        flushed, duplicates, failed = counts
+        self.flushed += flushed
+        self.duplicates += duplicates
+        self.failed += failed
+        if failed:
+            self.progress.writes_failed()
+        self.stats.inc_value('mongo/flushed', flushed)
+        self.stats.inc_value('mongo/duplicates', duplicates)
+        self.stats.inc_value('mongo/failed', failed)
+
+    def batch_failed(self, failure, size):
+        logging.error(f'Mongo batch of {size} items failed: {failure.getErrorMessage()}')
+        self.failed += size
+        self.progress.writes_failed()
+        self.stats.inc_value('mongo/failed', size)
+
+
+class JsonLinesPipeline:
+    def __init__(self, directory, compression='gzip', rotate_bytes=256 * 1024 * 1024):
+        self.writer = RotatingJsonLinesWriter(directory, compression=compression, rotate_bytes=rotate_bytes)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get('JSONL_DIR', 'output'),
+                   compression=crawler.settings.get('JSONL_COMPRESSION', 'gzip'),
+                   rotate_bytes=crawler.settings.getint('JSONL_ROTATE_MB', 256) * 1024 * 1024)
+
+    def open_spider(self, spider):
+        self.known_ids = spider.known_ids
+        spider.progress.barrier = self.barrier
+
+    def close_spider(self, spider):
+        ids = self.known_ids.take_unsaved()
+        self.writer.close()
+        self.known_ids.save(ids)
+
+    def barrier(self) -> defer.Deferred:
+        # Documents sit in the compressor's buffer until flushed
+        ids = self.known_ids.take_unsaved()
+        self.writer.flush()
+        self.known_ids.save(ids)
+        return defer.succeed(True)
 
     def process_item(self, item, spider):
-        self.collection.insert_one(item)
+        with spider.timings.stage('jsonl_write'):
+            self.writer.write(item.as_document())
+        spider.known_ids.add(item.id)
         return item
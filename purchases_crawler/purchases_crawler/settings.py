@@ -22,7 +22,7 @@ LOG_LEVEL = 'INFO'
 ROBOTSTXT_OBEY = True
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-#CONCURRENT_REQUESTS = 32
+CONCURRENT_REQUESTS = 32
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -52,21 +52,77 @@ DOWNLOAD_DELAY = 0.1
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    'purchases_crawler.purchases_crawler.middlewares.PurchasesCrawlerDownloaderMiddleware': 543,
-# }
+DOWNLOADER_MIDDLEWARES = {
+   # 'purchases_crawler.purchases_crawler.middlewares.PurchasesCrawlerDownloaderMiddleware': 543,
+   'purchases_crawler.purchases_crawler.middlewares.AdaptiveThrottleMiddleware': 543,
+   'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
+}
+
+# Adaptive throttling: search pages and card/supplier pages get separate download slots, each with its
+# own delay and concurrency budget, tuned from response latency, error responses and ban pages.
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_TARGET_LATENCY = 2.0
+ADAPTIVE_THROTTLE_SEARCH_PATTERN = r'publishDateFrom='
+ADAPTIVE_THROTTLE_BUDGETS = {
+   'search': {'min_delay': 0.5, 'max_delay': 60.0, 'start_delay': 1.0, 'start_concurrency': 1, 'max_concurrency': 2},
+   'card': {'min_delay': 0.1, 'max_delay': 60.0, 'start_delay': 0.5, 'start_concurrency': 2, 'max_concurrency': 8},
+}
+ADAPTIVE_THROTTLE_BAN_STATUSES = [403, 429]
+ADAPTIVE_THROTTLE_BAN_MARKERS = ['Доступ к сайту ограничен', 'captcha']
+RETRY_TIMES = 5
+
+# Placement dates are fed to the scheduler lazily: a new date is started only while fewer search
+# requests than this are outstanding, so the queue stays small and items are stored steadily
+MAX_PENDING_SEARCHES = 8
+
+# Purchases still without supplier results this many days after they were due (the application deadline) are
+# marked as having none, so enrich runs stop revisiting e.g. cancelled purchases
+SUPPLIERS_MAX_AGE_DAYS = 90
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+   'purchases_crawler.purchases_crawler.telemetry.CrawlTelemetry': 500,
+   'purchases_crawler.purchases_crawler.archive.RawPageArchive': 510,
+}
+
+# Stage timings, queue depths and per-date item rates, dumped to TELEMETRY_FILE (if set) every TELEMETRY_INTERVAL
+# seconds and served in Prometheus text format on 127.0.0.1:TELEMETRY_PROMETHEUS_PORT (0 disables the endpoint)
+TELEMETRY_ENABLED = True
+TELEMETRY_INTERVAL = 60
+TELEMETRY_FILE = ''
+TELEMETRY_PROMETHEUS_PORT = 0
+# Callbacks to profile (parse, parse_card, parse_suppliers) and the share of their calls that is sampled
+TELEMETRY_PROFILE_STAGES = []
+TELEMETRY_PROFILE_RATE = 0.01
+TELEMETRY_PROFILE_FILE = 'profile.pstats'
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
-   'purchases_crawler.purchases_crawler.pipelines.PurchasesCrawlerPipeline': 300,
+   # 'purchases_crawler.purchases_crawler.pipelines.PurchasesCrawlerPipeline': 300,
+   'purchases_crawler.purchases_crawler.pipelines.BatchedMongoPipeline': 300,
 }
+# Batched pipeline flushes after this many items or this many seconds, whichever comes first
+MONGO_BATCH_SIZE = 500
+MONGO_FLUSH_INTERVAL = 5.0
+# Mongo calls run on their own thread pool of this size (also the client connection pool size)
+MONGO_POOL_SIZE = 4
+# Write concern of purchase writes: number of nodes or 'majority'
+MONGO_WRITE_CONCERN = 1
+# With this many bulk writes in flight, items are held back and the crawl slows down to the database
+MONGO_MAX_PENDING_WRITES = 4
+# JsonLinesPipeline output: directory, compression (none, gzip or zstd) and uncompressed size of one file
+JSONL_DIR = 'output'
+JSONL_COMPRESSION = 'gzip'
+JSONL_ROTATE_MB = 256
+# Raw HTML of card and supplier pages for reprocess.py: directory, compression (zstd when available,
+# gzip otherwise) and uncompressed size of one segment
+RAW_ARCHIVE_ENABLED = False
+RAW_ARCHIVE_DIR = 'archive'
+RAW_ARCHIVE_COMPRESSION = None
+RAW_ARCHIVE_SEGMENT_MB = 256
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -84,7 +140,15 @@ ITEM_PIPELINES = {
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 #HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = 'httpcache'
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+HTTPCACHE_EXPIRATION_SECS = 24 * 3600
+HTTPCACHE_DIR = 'httpcache'
+HTTPCACHE_IGNORE_HTTP_CODES = [403, 429, 500, 502, 503, 504]
+HTTPCACHE_STORAGE = 'purchases_crawler.purchases_crawler.httpcache.RegistryCacheStorage'
+# Search pages expire quickly, pages of placement dates older than HTTPCACHE_OLD_PAGE_DAYS are kept longer
+HTTPCACHE_SEARCH_EXPIRATION_SECS = 3600
+HTTPCACHE_OLD_PAGE_DAYS = 90
+HTTPCACHE_OLD_PAGE_EXPIRATION_SECS = 30 * 24 * 3600
+# Least recently used pages are evicted above this size (0 disables eviction)
+HTTPCACHE_MAX_MB = 4096
+# Serve everything from the cache regardless of age, for re-parsing without network
+HTTPCACHE_REPLAY = False
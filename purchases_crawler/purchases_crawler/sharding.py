@@ -0,0 +1,144 @@
+import datetime
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from typing import Dict, List, Optional
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from twisted.internet import task
+
+from purchases_crawler.purchases_crawler.checkpoints import CheckpointStore, scoped_path, search_scope
+from purchases_crawler.purchases_crawler.spiders.goszakupki.purchase_object_spider import PurchaseObjectSpider
+
+PROGRESS_INTERVAL = 30.0
+
+
+def crawl_shard(spider_kwargs: dict, settings_overrides: dict, shard_index: int, shard_count: int, messages: multiprocessing.Queue):
+    os.environ['SCRAPY_SETTINGS_MODULE'] = 'purchases_crawler.purchases_crawler.settings'
+    settings = get_project_settings()
+    settings.setdict(settings_overrides, priority='cmdline')
+    settings.set('LOG_FORMAT', f'%(asctime)s [shard {shard_index}] [%(name)s] %(levelname)s: %(message)s')
+    # Every shard gets its own telemetry dump, profile and metrics port
+    for name in ('TELEMETRY_FILE', 'TELEMETRY_PROFILE_FILE'):
+        if settings.get(name):
+            root, ext = os.path.splitext(settings.get(name))
+            settings.set(name, f'{root}-{shard_index}{ext}')
+    if settings.getint('TELEMETRY_PROMETHEUS_PORT'):
+        settings.set('TELEMETRY_PROMETHEUS_PORT', settings.getint('TELEMETRY_PROMETHEUS_PORT') + shard_index)
+    crawler_process = CrawlerProcess(settings)
+    crawler = crawler_process.create_crawler(PurchaseObjectSpider)
+    crawler_process.crawl(crawler, shard_index=shard_index, shard_count=shard_count, **spider_kwargs)
+    reporter = task.LoopingCall(lambda: messages.put(('progress', shard_index, crawler.stats.get_stats())))
+    reporter.start(PROGRESS_INTERVAL, now=False)
+    crawler_process.start()
+    messages.put(('finished', shard_index, crawler.stats.get_stats()))
+
+
+def merge_stats(shard_stats: List[dict]) -> dict:
+    merged = {}
+    for stats in shard_stats:
+        for key, value in stats.items():
+            if key not in merged:
+                merged[key] = value
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                merged[key] = max(merged[key], value) if 'max' in key else merged[key] + value
+            elif isinstance(value, datetime.datetime):
+                merged[key] = min(merged[key], value) if key == 'start_time' else max(merged[key], value)
+    return merged
+
+
+def unfinished_dates(spider_kwargs: dict, shard_index: int, shard_count: int) -> List[str]:
+    # The shard's placement dates that its checkpoint file does not list as finished
+    checkpoint_file = spider_kwargs.get('checkpoint_file', ':memory:')
+    if spider_kwargs.get('mode') == 'enrich' or checkpoint_file == ':memory:':
+        return []
+    date_to = spider_kwargs.get('date_to')
+    date_to = datetime.datetime.strptime(date_to, '%Y-%m-%d') if date_to else datetime.datetime.today()
+    date_from = datetime.datetime.strptime(spider_kwargs.get('date_from') or PurchaseObjectSpider.FIRST_PLACEMENT_DATE, '%Y-%m-%d')
+    store = CheckpointStore(scoped_path(checkpoint_file, search_scope(spider_kwargs['start_urls'][0])))
+    try:
+        return [placement_date.strftime('%d.%m.%Y')
+                for placement_date in PurchaseObjectSpider.shard_dates(date_to, date_from, shard_index, shard_count)
+                if not store.is_date_finished(placement_date.strftime('%d.%m.%Y'))]
+    finally:
+        store.close()
+
+
+def run_sharded(spider_kwargs: dict, workers: int, max_restarts: int = 3, settings_overrides: Optional[dict] = None) -> dict:
+    # Every shard gets its own process, spider and mongo client. A shard that dies, or exits with some of its
+    # placement dates unfinished, is restarted with resume enabled, so the dates it had already finished are
+    # skipped and none are lost. Shards still unfinished after max_restarts are counted in shards/failed.
+    context = multiprocessing.get_context('spawn')
+    messages = context.Queue()
+    processes: Dict[int, multiprocessing.Process] = {}
+    restarts = {shard: 0 for shard in range(workers)}
+    latest: Dict[int, dict] = {}
+    final: Dict[int, dict] = {}
+    failed = set()
+
+    def start(shard: int, kwargs: dict):
+        process = context.Process(target=crawl_shard, args=(kwargs, settings_overrides or {}, shard, workers, messages), name=f'shard-{shard}')
+        process.start()
+        processes[shard] = process
+
+    def receive(timeout: float):
+        while True:
+            try:
+                kind, shard, stats = messages.get(timeout=timeout)
+            except queue.Empty:
+                return
+            latest[shard] = stats
+            if kind == 'finished':
+                final[shard] = stats
+            timeout = 0.0
+
+    for shard in range(workers):
+        start(shard, spider_kwargs)
+    last_report = time.monotonic()
+    try:
+        while processes:
+            receive(timeout=1.0)
+            for shard, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                # Pick up the final stats the shard sent right before exiting
+                receive(timeout=0.1)
+                del processes[shard]
+                if shard in final and process.exitcode == 0:
+                    unfinished = unfinished_dates(spider_kwargs, shard, workers)
+                    if not unfinished:
+                        continue
+                    reason = f'left {len(unfinished)} placement dates unfinished ({", ".join(unfinished[:5])})'
+                else:
+                    reason = f'exited with code {process.exitcode}'
+                if restarts[shard] >= max_restarts:
+                    logging.error(f'Shard {shard} {reason}, giving up after {max_restarts} restarts')
+                    failed.add(shard)
+                    continue
+                restarts[shard] += 1
+                logging.warning(f'Shard {shard} {reason}, restarting ({restarts[shard]}/{max_restarts})')
+                final.pop(shard, None)
+                start(shard, dict(spider_kwargs, resume=True))
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                log_progress(latest)
+    except KeyboardInterrupt:
+        for process in processes.values():
+            process.terminate()
+        raise
+    merged = merge_stats([final.get(shard, latest.get(shard, {})) for shard in range(workers)])
+    merged['shards/failed'] = len(failed)
+    log_progress(latest)
+    logging.info(f'Merged stats of {workers} shards: {merged}')
+    return merged
+
+
+def log_progress(latest: Dict[int, dict]):
+    total = merge_stats(list(latest.values()))
+    shards = ' '.join(f'{shard}:{stats.get("item_scraped_count", 0)}' for shard, stats in sorted(latest.items()))
+    logging.info(f'Items scraped: {total.get("item_scraped_count", 0)} Requests: {total.get("downloader/request_count", 0)} '
+                 f'Per shard: {shards}')
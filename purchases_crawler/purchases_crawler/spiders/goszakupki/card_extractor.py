@@ -0,0 +1,218 @@
+import logging
+import re
+import urllib.parse
+from typing import Dict, List, NamedTuple, Optional, Tuple, Type
+
+from lxml import etree
+from parsel.csstranslator import css2xpath
+
+from purchases_crawler.purchases_crawler.items import SUPPLIERS_NONE, SUPPLIERS_PENDING, PurchaseItem, PurchasePosition, Supplier, parse_date
+from purchases_crawler.purchases_crawler.telemetry import StageTimings
+
+normalization_pattern = re.compile(r'\s+|\r|\n|\r\n')
+whitespace_pattern = re.compile(r'\s')
+number_pattern = re.compile(r'[-+]?\d*[.,]\d+|\d+')
+
+
+def compile_css(query: str) -> etree.XPath:
+    return etree.XPath(css2xpath(query), smart_strings=False)
+
+
+# Selectors are translated and compiled once and evaluated directly on lxml elements,
+# which skips both the per-call CSS translation and the parsel Selector wrappers.
+PURCHASE_LINK = compile_css('span.cardMainInfo__purchaseLink a::text')
+MAIN_INFO_SECTIONS = compile_css('div.sectionMainInfo__body div.cardMainInfo__section')
+DATE_SECTIONS = compile_css('div.date div.cardMainInfo__section')
+MAIN_INFO_TITLE = compile_css('span.cardMainInfo__title::text')
+MAIN_INFO_CONTENT = compile_css('span.cardMainInfo__content::text')
+BLOCKS = compile_css('div.blockInfo')
+BLOCK_TITLE = compile_css('h2.blockInfo__title')
+BLOCK_SECTIONS = compile_css('section')
+SECTION_TITLE = compile_css('span.section__title::text')
+SECTION_INFO = compile_css('span.section__info::text')
+PURCHASE_OBJECT_TABLES = compile_css('table.tableBlock')
+SUPPLIER_DIVS = compile_css('div[id^=supplier-def-result-participant-table]')
+TABLES = compile_css('table')
+TABLE_HEAD = compile_css('thead')
+TABLE_HEAD_CELLS = compile_css('th, td')
+TABLE_BODY = compile_css('tbody.tableBlock__body')
+TABLE_ROWS = compile_css('tr.tableBlock__row, table')
+TABLE_CELLS = compile_css('td.tableBlock__col')
+TEXT = compile_css('::text')
+NAV_TABS = compile_css('a.tabsNav__item')
+HREF = compile_css('::attr(href)')
+
+Sections = List[Tuple[str, str]]
+
+
+class CardExtractor:
+    PURCHASE_POSITION_COLUMNS = {
+        'Код позиции': 'code',
+        'Наименование Товара, Работы, Услуги по КТРУ': 'name',
+        'Лек. форма, дозировка и ед. измерения': 'name',
+        'Ед. измерения': 'unit',
+        'Количество': 'quantity',
+        'Цена за ед., ₽': 'price_per_unit',
+        'Начальная цена за единицу товара': 'price_per_unit',
+        'Стоимость, ₽': 'total_price',
+    }
+    SUPPLIER_COLUMNS = {
+        'Участник(и), с которыми планируется заключить контракт': 'name',
+        'Наименование участника': 'name',
+        'Порядковые номера, полученные по результатам рассмотрения заявок': 'number',
+        'Порядковый номер, полученный по результатам рассмотрения заявки': 'number',
+        'Предложения участников, ₽': 'offer',
+        'Предложение участника, ₽': 'offer',
+    }
+    SUPPLIER_RESULTS_TAB = 'Результаты определения поставщика'
+    PURCHASE_POSITION_NUMBERS = ('quantity', 'price_per_unit', 'total_price')
+    SUPPLIER_NUMBERS = ('offer',)
+
+    def __init__(self, timings: Optional[StageTimings] = None):
+        self.timings = timings or StageTimings()
+
+    def extract_card(self, root, url: str) -> PurchaseItem:
+        main_info = self.sections(MAIN_INFO_SECTIONS(root), MAIN_INFO_TITLE, MAIN_INFO_CONTENT)
+        dates = self.sections(DATE_SECTIONS(root), MAIN_INFO_TITLE, MAIN_INFO_CONTENT)
+        purchase_object = self.find(main_info, 'Объект закупки', '')
+        placement_date = self.find(dates, 'Размещено')
+        application_deadline = self.find(dates, 'Окончание подачи заявок')
+
+        customer = None
+        region = None
+        start_price = None
+        currency = None
+        purchase_positions = []
+        for block in BLOCKS(root):
+            block_titles = BLOCK_TITLE(block)
+            if not block_titles:
+                continue
+            block_title = block_titles[0].xpath('string()')
+            if 'Контактная информация' in block_title:
+                sections = self.sections(BLOCK_SECTIONS(block), SECTION_TITLE, SECTION_INFO)
+                customer = self.find(sections, 'Организация', customer)
+                region = self.find(sections, 'Регион', region)
+            if 'цена контракта' in block_title:
+                sections = self.sections(BLOCK_SECTIONS(block), SECTION_TITLE, SECTION_INFO)
+                start_price = self.find(sections, 'цена контракта', start_price)
+                currency = self.find(sections, 'Валюта', currency)
+            if 'Информация об объекте закупки' in block_title:
+                purchase_positions = self.parse_table(PURCHASE_OBJECT_TABLES(block), self.PURCHASE_POSITION_COLUMNS,
+                                                      PurchasePosition, self.PURCHASE_POSITION_NUMBERS, url)
+
+        id = PURCHASE_LINK(root)
+        return PurchaseItem(
+            id=(id[0] if id else '').replace('№', '').strip(),
+            url=url,
+            object=self.normalize_string(purchase_object),
+            customer=customer.strip() if customer is not None else None,
+            placement_date=parse_date(placement_date),
+            application_deadline=parse_date(application_deadline),
+            region=region.strip() if region is not None else None,
+            start_price=self.parse_number(start_price.strip() if start_price is not None else None),
+            currency=currency.strip() if currency is not None else None,
+            purchase_positions=purchase_positions,
+            suppliers_status=None,
+            suppliers_url=None,
+        )
+
+    def extract_purchase(self, root, url: str) -> PurchaseItem:
+        # The card with its supplier results stage: no results tab, or results to be fetched from suppliers_url
+        result = self.extract_card(root, url)
+        suppliers_urls = self.supplier_results_urls(root)
+        if not suppliers_urls:
+            result.suppliers_status = SUPPLIERS_NONE
+        else:
+            result.suppliers_status = SUPPLIERS_PENDING
+            result.suppliers_url = urllib.parse.urljoin(url, suppliers_urls[0])
+        return result
+
+    def supplier_results_urls(self, root) -> List[str]:
+        urls = []
+        for nav_link in NAV_TABS(root):
+            text = TEXT(nav_link)
+            if text and self.SUPPLIER_RESULTS_TAB in text[0]:
+                href = HREF(nav_link)
+                if href:
+                    urls.append(str(href[0]))
+        return urls
+
+    def extract_suppliers(self, root, url: str) -> Optional[List[Supplier]]:
+        supplier_divs = SUPPLIER_DIVS(root)
+        if not supplier_divs:
+            return None
+        tables = [table for supplier_div in supplier_divs for table in TABLES(supplier_div)]
+        return self.parse_table(tables, self.SUPPLIER_COLUMNS, Supplier, self.SUPPLIER_NUMBERS, url)
+
+    def parse_table(self, tables, column_mapping: Dict[str, str], record_type: Type[NamedTuple], numbers: Tuple[str, ...],
+                    url: str) -> list:
+        with self.timings.stage('parse_table'):
+            return self.parse_table_rows(tables, column_mapping, record_type, numbers, url)
+
+    def parse_table_rows(self, tables, column_mapping: Dict[str, str], record_type: Type[NamedTuple], numbers: Tuple[str, ...],
+                         url: str) -> list:
+        # Cells go straight into record fields by position; numeric columns are parsed right here
+        result = []
+        if not tables:
+            return result
+        fields = record_type._fields
+        numeric_fields = {fields.index(name) for name in numbers}
+        index_mapping = {}
+        excluded_idx = set()
+        thead = [head for table in tables for head in TABLE_HEAD(table)]
+        column_headers = TABLE_HEAD_CELLS(thead[0]) if thead else []
+        for idx, column_header in enumerate(column_headers):
+            text = TEXT(column_header)
+            column_header_text = text[0].strip() if text else ''
+            column_name = column_mapping.get(column_header_text)
+            if column_name:
+                index_mapping[idx] = fields.index(column_name)
+            else:
+                excluded_idx.add(idx)
+                if column_header_text != '':
+                    logging.debug(f'Column mapping not found: {column_header_text} URL: {url}')
+        rows = [row for table in tables for tbody in TABLE_BODY(table) for row in TABLE_ROWS(tbody)]
+        for row in rows:
+            if row.tag == 'table':
+                break
+            values = [None] * len(fields)
+            for idx, cell in enumerate(TABLE_CELLS(row)):
+                field = index_mapping.get(idx)
+                if field is not None:
+                    text = self.normalize_string(' '.join(TEXT(cell)))
+                    values[field] = self.parse_number(text) if field in numeric_fields else text
+                elif idx not in excluded_idx:
+                    logging.debug(f'Column name for index {idx} not found. URL: {url}')
+            result.append(record_type._make(values))
+        return result
+
+    @staticmethod
+    def sections(elements, title_xpath: etree.XPath, content_xpath: etree.XPath) -> Sections:
+        sections = []
+        for element in elements:
+            title = title_xpath(element)
+            if title:
+                content = content_xpath(element)
+                sections.append((title[0], content[0] if content else ''))
+        return sections
+
+    @staticmethod
+    def find(sections: Sections, title_part: str, default: Optional[str] = None) -> Optional[str]:
+        # Later sections win, same as overwriting the value while walking the page
+        for title, content in reversed(sections):
+            if title_part in title:
+                return content
+        return default
+
+    @staticmethod
+    def normalize_string(input_str: str) -> str:
+        return normalization_pattern.sub(' ', input_str).strip()
+
+    @staticmethod
+    def parse_number(input_str: Optional[str]) -> Optional[float]:
+        if not input_str:
+            return None
+        numbers = number_pattern.findall(whitespace_pattern.sub('', input_str))
+        if not numbers:
+            return None
+        return float(numbers[0].replace(',', '.'))
@@ -2,33 +2,227 @@ import datetime
 import logging
 import re
 import urllib.parse
+import zlib
 from typing import Optional
 
 import scrapy
-from pymongo import MongoClient
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet import defer
 
-normalization_pattern = re.compile(r'\s+|\r|\n|\r\n')
+from purchases_crawler.purchases_crawler.checkpoints import (CheckpointStore, CrawlProgress, scoped_path, search_fingerprint,
+                                                             search_scope, tracked)
+from purchases_crawler.purchases_crawler.items import (SUPPLIERS_DONE, SUPPLIERS_NONE, SUPPLIERS_PENDING, InvalidPurchase,
+                                                       SuppliersPatch, parse_date)
+from purchases_crawler.purchases_crawler.known_ids import FileIdStore, KnownIdIndex
+from purchases_crawler.purchases_crawler.partitioning import PricePartitionPlanner
+from purchases_crawler.purchases_crawler.spiders.goszakupki.card_extractor import CardExtractor
+from purchases_crawler.purchases_crawler.store import MemoryStore, MongoStore
+from purchases_crawler.purchases_crawler.telemetry import StageTimings, timed
+
+whitespace_pattern = re.compile(r'\s')
+digits_pattern = re.compile(r'[\d]+')
 
 
 class PurchaseObjectSpider(scrapy.Spider):
     RECORDS_PER_PAGE = 500
     MAX_ITEMS_PER_SEARCH = 4000
-    PRICE_INTERVALS = [(0, 1000), (1001, 1000000), (1000001, 1000000000)]
+    PRICE_INTERVALS = [(0, 1000), (1001, 1000000), (1000001, 1000000000), (1000000001, 1000000000000000)]
+    FIRST_PLACEMENT_DATE = '2013-04-01'
+    MODES = ('full', 'incremental', 'range', 'enrich')
+    STORAGES = ('mongo', 'jsonl', 'memory')
+    # Deeper pages go first, so cards and supplier tabs of dates in progress are not starved by search pagination
+    SEARCH_PRIORITY = 0
+    CARD_PRIORITY = 10
+    SUPPLIERS_PRIORITY = 20
 
-    def __init__(self, start_urls, connection_string, *args, **kwargs):
+    def __init__(self, start_urls, connection_string=None, known_ids_file=None, partition_cache=None, mode='full',
+                 date_from=None, date_to=None, recent_days=7, verify_days=90, resume=False, checkpoint_file=':memory:',
+                 shard_index=0, shard_count=1, storage='mongo', reparse=False, *args, **kwargs):
         self.connection_string = connection_string
         self.name = "objects"
-        self.start_urls = self.generate_urls(start_urls[0], datetime.datetime.today(), datetime.datetime.strptime('2013-04-01', '%Y-%m-%d'))
-        self.client = MongoClient(connection_string)
-        self.collection = self.client.get_database()['purchases']
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown crawl mode: {mode}')
+        self.mode = mode
+        self.recent_days = int(recent_days)
+        self.verify_days = int(verify_days)
+        self.resume = resume in (True, 'true', 'True', '1')
+        # Re-parse every card listed, even of unchanged search pages and known purchases (replay of the cache)
+        self.reparse = reparse in (True, 'true', 'True', '1')
+        self.today = datetime.datetime.today()
+        self.shard_index = int(shard_index)
+        self.shard_count = int(shard_count)
+        date_to = datetime.datetime.strptime(date_to, '%Y-%m-%d') if date_to else self.today
+        date_from = datetime.datetime.strptime(date_from or self.FIRST_PLACEMENT_DATE, '%Y-%m-%d')
+        self.start_urls = self.generate_urls(start_urls[0], date_to, date_from)
+        # Enrich mode revisits stored purchases only and runs no searches
+        self.pending_dates = iter(()) if mode == 'enrich' else iter(self.start_urls)
+        self.pending_searches = 0
+        self.max_pending_searches = 8
+        self.suppliers_max_age = datetime.timedelta(days=90)
+        if storage not in self.STORAGES:
+            raise ValueError(f'Unknown storage: {storage}')
+        self.storage = storage
+        if storage == 'jsonl' and not known_ids_file:
+            raise ValueError(f'{storage} storage needs a known_ids_file')
+        if mode == 'enrich' and storage == 'jsonl':
+            raise ValueError('enrich mode reads pending purchases from the purchase store')
+        # The purchase store is opened in from_crawler, where its pool and write concern settings are known;
+        # known ids come from it in spider_opened unless a local file is given
+        self.store = None
+        self.known_ids = KnownIdIndex(FileIdStore(known_ids_file) if known_ids_file else None)
+        self.enrich_documents = []
+        scope = search_scope(start_urls[0])
+        partition_cache = scoped_path(partition_cache, scope)
+        checkpoint_file = scoped_path(checkpoint_file, scope)
+        logging.info(f'Checkpoints: {checkpoint_file} Partition layouts: {partition_cache}')
+        self.planner = PricePartitionPlanner(self.PRICE_INTERVALS, self.MAX_ITEMS_PER_SEARCH, partition_cache)
+        self.checkpoints = CheckpointStore(checkpoint_file)
+        self.progress = CrawlProgress(self.checkpoints)
+        self.timings = StageTimings()
+        self.extractor = CardExtractor(self.timings)
         super(PurchaseObjectSpider, self).__init__(*args, **kwargs)
 
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(PurchaseObjectSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.max_pending_searches = crawler.settings.getint('MAX_PENDING_SEARCHES', spider.max_pending_searches)
+        spider.suppliers_max_age = datetime.timedelta(days=crawler.settings.getint('SUPPLIERS_MAX_AGE_DAYS', 90))
+        if spider.storage == 'mongo':
+            spider.store = MongoStore.from_settings(spider.connection_string, crawler.settings, spider.timings)
+        elif spider.storage == 'memory':
+            spider.store = MemoryStore(max_pending_writes=crawler.settings.getint('MONGO_MAX_PENDING_WRITES', 4), timings=spider.timings)
+        crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    def spider_opened(self, spider):
+        # The engine waits for the returned Deferred before it starts consuming start_requests
+        loads = []
+        if self.store is not None and self.known_ids.store is None:
+            loads.append(self.store.load_ids(self.known_ids.load))
+        if self.mode == 'enrich':
+            loads.append(self.store.pending_suppliers().addCallback(self.set_enrich_documents))
+        d = defer.gatherResults(loads, consumeErrors=True)
+        d.addErrback(self.store_failed)
+        return d
+
+    def set_enrich_documents(self, documents):
+        self.enrich_documents = documents
+        logging.info(f'Purchases with pending supplier results: {len(documents)}')
+
+    def store_failed(self, failure):
+        logging.error(f'Purchase store is unavailable: {failure.getErrorMessage()}')
+        self.crawler.engine.close_spider(self, 'store_unavailable')
+
+    def spider_idle(self, spider):
+        requests = list(self.next_dates())
+        for request in requests:
+            self.crawler.engine.crawl(request, self)
+        if requests:
+            raise DontCloseSpider
+
+    def closed(self, reason):
+        self.known_ids.close()
+        if self.store is not None:
+            self.store.close()
+        self.planner.save()
+        self.checkpoints.close()
+
+    def start_requests(self):
+        if self.mode == 'enrich':
+            yield from self.enrich_requests()
+            return
+        yield from self.next_dates()
+
+    def enrich_requests(self):
+        # Revisits stored purchases whose supplier results were deferred until their application deadline
+        for document in self.enrich_documents:
+            if zlib.crc32(document['id'].encode()) % self.shard_count != self.shard_index:
+                continue
+            if document.get('suppliers_url') and self.deadline_passed(document.get('application_deadline')):
+                yield self.suppliers_request(document['suppliers_url'], document['id'], None,
+                                             self.results_due(document.get('application_deadline'), document.get('placement_date')))
+
+    def next_dates(self):
+        # Dates are fed lazily, only while fewer than max_pending_searches searches are outstanding.
+        # Refilled after every search page and when the spider goes idle.
+        while self.pending_searches < self.max_pending_searches:
+            url = next(self.pending_dates, None)
+            if url is None:
+                return
+            # All partitions of a date are registered before the first one is yielded, so the date
+            # cannot be checkpointed while some of its searches are still waiting to be scheduled.
+            yield from self.date_requests(url)
+
+    def date_requests(self, url) -> []:
+        placement_date = self.get_url_param(url, 'publishDateFrom')
+        age = (self.today - datetime.datetime.strptime(placement_date, '%d.%m.%Y')).days
+        incremental = self.mode == 'incremental' and age > self.recent_days
+        verify = incremental and age <= self.verify_days
+        if (incremental or self.resume) and not verify and self.checkpoints.is_date_finished(placement_date):
+            logging.debug(f'Placement date already finished: {placement_date}')
+            return []
+        requests = []
+        for price_range in self.planner.intervals(placement_date):
+            partition = (placement_date, *price_range)
+            known_total = self.checkpoints.partition_total(partition) if incremental or self.resume else None
+            if known_total is not None and not verify:
+                continue
+            requests.append(self.search_request(self.set_price_range(url, price_range), partition, known_total=known_total))
+        if requests:
+            self.checkpoints.date_unfinished(placement_date)
+        return requests
+
+    def search_request(self, url: str, partition, **meta) -> scrapy.Request:
+        self.progress.started(partition)
+        self.pending_searches += 1
+        return scrapy.Request(url, callback=self.parse, errback=self.request_failed, dont_filter=True,
+                              priority=self.SEARCH_PRIORITY, meta=dict(partition=partition, **meta))
+
+    def suppliers_request(self, url: str, purchase_id: str, partition, due: Optional[datetime.datetime]) -> scrapy.Request:
+        if partition is not None:
+            self.progress.started(partition)
+        return scrapy.Request(url, callback=self.parse_suppliers, errback=self.request_failed, dont_filter=True,
+                              priority=self.SUPPLIERS_PRIORITY, cb_kwargs=dict(purchase_id=purchase_id, due=due),
+                              meta=dict(partition=partition))
+
+    def request_failed(self, failure):
+        logging.error(f'Request failed: {failure.request.url} {failure.getErrorMessage()}')
+        if failure.request.callback == self.parse:
+            self.pending_searches -= 1
+        if failure.request.meta['partition'] is not None:
+            self.progress.finished(failure.request.meta['partition'], failed=True)
+
+    def deadline_passed(self, deadline) -> bool:
+        # Supplier results appear only after applications close; an unknown deadline is checked right away.
+        # Purchases stored before dates were typed keep the deadline as the page text.
+        if isinstance(deadline, str):
+            deadline = parse_date(deadline)
+        return deadline is None or deadline < self.today
+
+    @staticmethod
+    def results_due(deadline, placement_date) -> Optional[datetime.datetime]:
+        # When supplier results are expected at the latest: the application deadline, else the placement date
+        for value in (deadline, placement_date):
+            if isinstance(value, str):
+                value = parse_date(value)
+            if value is not None:
+                return value
+        return None
+
     def generate_urls(self, url, start_date, end_date):
+        for placement_date in self.shard_dates(start_date, end_date, self.shard_index, self.shard_count):
+            yield self.get_new_search_url(url, placement_date)
+
+    @staticmethod
+    def shard_dates(start_date, end_date, shard_index, shard_count):
         placement_date = start_date
         while placement_date >= end_date:
-            search_url = self.get_new_search_url(url, placement_date)
+            # Shards take every shard_count-th day, which keeps them disjoint and evenly loaded
+            if placement_date.toordinal() % shard_count == shard_index:
+                yield placement_date
             placement_date -= datetime.timedelta(days=1)
-            yield search_url
 
     def get_new_search_url(self, url, placement_date):
         logging.info("New search placement date: " + placement_date.strftime('%d.%m.%Y'))
@@ -45,183 +239,105 @@ class PurchaseObjectSpider(scrapy.Spider):
         url_parts[4] = urllib.parse.urlencode(query)
         return urllib.parse.urlunparse(url_parts)
 
+    def set_price_range(self, url: str, price_range: (int, int)) -> str:
+        return self.set_url_param(url, {'priceFromGeneral': str(price_range[0]), 'priceToGeneral': str(price_range[1]),
+                                        'pageNumber': '1'})
+
     def get_url_param(self, url: str, key: str) -> Optional[str]:
         url_parts = list(urllib.parse.urlparse(url))
         query = dict(urllib.parse.parse_qsl(url_parts[4]))
         return query[key]
 
-    def parse(self, response, current_intervals=None):
-        page_number = 1
-        if current_intervals is None:
-            current_intervals = self.PRICE_INTERVALS.copy()
-        if len(current_intervals) > 0:
-            interval = current_intervals.pop()
-            url = self.set_url_param(response.request.url, {'priceFromGeneral': str(interval[0]), 'priceToGeneral': str(interval[1])})
-            yield scrapy.Request(url, callback=self.parse, cb_kwargs=dict(current_intervals=current_intervals))
+    @timed('parse')
+    def parse(self, response):
+        self.pending_searches -= 1
+        yield from self.parse_search(response)
+        yield from self.next_dates()
+
+    @tracked
+    def parse_search(self, response):
+        url = response.request.url
+        partition = response.meta['partition']
+        placement_date = partition[0]
+        price_range = partition[1:]
+        page_number = int(self.get_url_param(url, 'pageNumber'))
         purchases = response.css('div.registry-entry__form')
-        result_number = int(re.findall(r'[\d]+', re.sub(r'\s', '', response.css('div.search-results__total::text').get().strip()))[0])
-        if result_number > self.MAX_ITEMS_PER_SEARCH:
-            price_to = int(self.get_url_param(response.request.url, 'priceToGeneral'))
-            current_intervals.append((price_to // 2 + 1, price_to))
-            logging.info('New intervals: ' + str(current_intervals))
-            search_url = self.set_url_param(response.request.url, {'priceToGeneral': str(price_to // 2)})
-            yield scrapy.Request(search_url, callback=self.parse, cb_kwargs=dict(current_intervals=current_intervals))
+        result_number = int(digits_pattern.findall(whitespace_pattern.sub('', response.css('div.search-results__total::text').get()))[0])
+        if result_number > self.MAX_ITEMS_PER_SEARCH and price_range[0] < price_range[1]:
+            intervals = self.planner.split(placement_date, price_range, result_number)
+            # A range the planner cannot split would be searched again unchanged forever; it is paginated instead
+            if intervals != [price_range]:
+                logging.info(f'New intervals: {intervals} Result number: {result_number} Placement date: {placement_date}')
+                self.progress.partition_split(partition)
+                self.crawler.stats.inc_value('partitions/splits', spider=self)
+                for interval in intervals:
+                    yield self.search_request(self.set_price_range(url, interval), (placement_date, *interval))
+                return
+            logging.warning(f'Price range not split: {price_range} Result number: {result_number} Placement date: {placement_date}')
+        if page_number == 1:
+            self.planner.record(placement_date, price_range, result_number)
+        if page_number == 1 and response.meta.get('known_total') == result_number:
+            self.progress.page_finished(partition, page_number, result_number)
+            logging.debug(f'Result number unchanged: {result_number} URL: {url}')
+            return
+        card_urls = response.css('div.registry-entry__form div.registry-entry__header-mid__number a::attr(href)').getall()
+        reg_numbers = [self.get_url_param(card_url, 'regNumber') for card_url in card_urls]
+        fingerprint = search_fingerprint(result_number, reg_numbers)
+        # Compared before page_finished replaces the stored fingerprint. An unchanged page of a finished partition
+        # whose purchases are all known means its cards are stored already and, with the same total, the following
+        # pages did not change either. Purchases lost with a failed or unflushed write are fetched again by a
+        # later run: their ids are persisted only once the storage pipeline has written them.
+        unchanged = (not self.reparse and self.checkpoints.page_fingerprint(partition, page_number) == fingerprint
+                     and all(reg_number in self.known_ids for reg_number in reg_numbers))
+        self.progress.page_finished(partition, page_number, result_number, fingerprint)
+        if unchanged:
+            self.crawler.stats.inc_value('searches/unchanged_pages', spider=self)
+            logging.debug(f'Search page unchanged: {result_number} URL: {url}')
             return
         logging.info(f'Result number: {result_number} Result on page: {len(purchases)} URL: {response.request.url}')
-        for purchase in purchases:
-            url = purchase.css('div.registry-entry__header-mid__number a::attr(href)').get()
-            reg_number = self.get_url_param(url, 'regNumber')
-            if self.collection.count_documents({'id': reg_number}, limit=1) == 0:
-                yield scrapy.Request(response.urljoin(url), callback=self.parse_card)
+        with self.timings.stage('dedup'):
+            new_card_urls = [card_url for card_url, reg_number in zip(card_urls, reg_numbers)
+                             if self.reparse or reg_number not in self.known_ids]
+        for card_url in new_card_urls:
+            self.progress.started(partition)
+            yield scrapy.Request(response.urljoin(card_url), callback=self.parse_card, errback=self.request_failed,
+                                 dont_filter=True, priority=self.CARD_PRIORITY, meta=dict(partition=partition))
         if len(purchases) < self.RECORDS_PER_PAGE:
             return
         else:
-            page_number += 1
-            url = self.set_url_param(response.request.url, {'pageNumber': str(page_number)})
-            yield scrapy.Request(url, callback=self.parse, cb_kwargs=dict(current_intervals=current_intervals))
+            url = self.set_url_param(url, {'pageNumber': str(page_number + 1)})
+            yield self.search_request(url, partition)
 
+    @timed('parse_card')
+    @tracked
     def parse_card(self, response):
-        id = response.css('span.cardMainInfo__purchaseLink a::text').get(default='')
-        main_info = response.css('div.sectionMainInfo__body')
-        purchase_object = ''
-        customer = None
-        if main_info:
-            main_info_sections = main_info.css('div.cardMainInfo__section')
-            for main_info_section in main_info_sections:
-                main_info_section_title = main_info_section.css('span.cardMainInfo__title::text').get()
-                if main_info_section_title and 'Объект закупки' in main_info_section_title:
-                    purchase_object = main_info_section.css('span.cardMainInfo__content::text').get(default='')
-                # if main_info_section_title and customer_pattern.search(main_info_section_title):
-                #     customer = main_info_section.css('span.cardMainInfo__content a::text').get().strip()
-
-        application_deadline = None
-        placement_date = None
-        date_div = response.css('div.date')
-        if date_div:
-            sections = date_div.css('div.cardMainInfo__section')
-            for section in sections:
-                section_title = section.css('span.cardMainInfo__title::text').get()
-                if section_title and 'Размещено' in section_title:
-                    placement_date = section.css('span.cardMainInfo__content::text').get(default='').strip()
-                if section_title and 'Окончание подачи заявок' in section_title:
-                    application_deadline = section.css('span.cardMainInfo__content::text').get(default='').strip()
-
-        region = None
-        start_price = None
-        currency = None
-        purchase_positions = []
-        blocks = response.css('div.blockInfo')
-        for block in blocks:
-            block_title = block.css('h2.blockInfo__title').get()
-            if block_title and 'Контактная информация' in block_title:
-                sections = block.css('section')
-                for section in sections:
-                    section_title = section.css('span.section__title::text').get()
-                    if section_title and 'Организация' in section_title:
-                        customer = section.css('span.section__info::text').get(default='').strip()
-                    if section_title and 'Регион' in section_title:
-                        region = section.css('span.section__info::text').get(default='').strip()
-            if block_title and 'цена контракта' in block_title:
-                sections = block.css('section')
-                for section in sections:
-                    section_title = section.css('span.section__title::text').get()
-                    if section_title and 'цена контракта' in section_title:
-                        start_price = section.css('span.section__info::text').get(default='').strip()
-                    if section_title and 'Валюта' in section_title:
-                        currency = section.css('span.section__info::text').get(default='').strip()
-            if block_title and 'Информация об объекте закупки' in block_title:
-                column_mapping = {
-                    'Код позиции': 'code',
-                    'Наименование Товара, Работы, Услуги по КТРУ': 'name',
-                    'Лек. форма, дозировка и ед. измерения': 'name',
-                    'Ед. измерения': 'unit',
-                    'Количество': 'quantity',
-                    'Цена за ед., ₽': 'price_per_unit',
-                    'Начальная цена за единицу товара': 'price_per_unit',
-                    'Стоимость, ₽': 'total_price',
-                }
-                purchase_positions = self.parse_table(block.css('table.tableBlock'), column_mapping, response.request.url)
-                for position in purchase_positions:
-                    position['quantity'] = self.parse_number(position.get('quantity'))
-                    position['price_per_unit'] = self.parse_number(position.get('price_per_unit'))
-                    position['total_price'] = self.parse_number(position.get('total_price'))
-
-        result = {
-            'id': id.replace('№', '').strip(),
-            'url': response.request.url,
-            'object': self.normalize_string(purchase_object),
-            'customer': customer,
-            'placement_date': placement_date,
-            'application_deadline': application_deadline,
-            'region': region,
-            'start_price': self.parse_number(start_price),
-            'currency': currency,
-            'purchase_positions': purchase_positions
-        }
-        nav_tabs = response.css('a.tabsNav__item')
-        for nav_link in nav_tabs:
-            if 'Результаты определения поставщика' in nav_link.css('::text').get(default=''):
-                nav_url = nav_link.css('::attr(href)').get(default=None)
-                if nav_url:
-                    yield scrapy.Request(response.urljoin(nav_url), callback=self.parse_suppliers, cb_kwargs=dict(result=result))
-
-    def parse_suppliers(self, response, result):
-        supplier_div = response.css('div[id^=supplier-def-result-participant-table]')
-        if supplier_div:
-            column_mapping = {
-                'Участник(и), с которыми планируется заключить контракт': 'name',
-                'Наименование участника': 'name',
-                'Порядковые номера, полученные по результатам рассмотрения заявок': 'number',
-                'Порядковый номер, полученный по результатам рассмотрения заявки': 'number',
-                'Предложения участников, ₽': 'offer',
-                'Предложение участника, ₽': 'offer',
-            }
-            suppliers = self.parse_table(supplier_div.css('table'), column_mapping, response.request.url)
-            for supplier in suppliers:
-                supplier['offer'] = self.parse_number(supplier.get('offer'))
-            result['suppliers'] = suppliers
+        try:
+            result = self.extractor.extract_purchase(response.selector.root, response.request.url)
+        except InvalidPurchase as e:
+            # Dropped without failing the partition, so one odd page does not leave its whole date unfinished
+            logging.warning(f'Card dropped: {e}')
+            self.crawler.stats.inc_value('purchases/invalid_cards', spider=self)
+            return
+        # The card is stored right away; supplier results are a separate stage that patches the stored
+        # document, fetched now if applications are closed and left to the enrich mode otherwise
         yield result
+        if result.suppliers_status != SUPPLIERS_PENDING:
+            return
+        if self.deadline_passed(result.application_deadline):
+            yield self.suppliers_request(result.suppliers_url, result.id, response.meta['partition'],
+                                         self.results_due(result.application_deadline, result.placement_date))
+        else:
+            self.crawler.stats.inc_value('purchases/suppliers_deferred', spider=self)
 
-    def parse_table(self, table, column_mapping, url) -> []:
-        result = []
-        index_mapping = {}
-        excluded_idx = []
-        if table:
-            thead = table.css('thead')
-            if len(thead) > 1:
-                thead = thead[0]
-            column_headers = thead.css('th, td')
-            for idx, column_header in enumerate(column_headers):
-                column_header_text = column_header.css('::text').get().strip()
-                column_name = column_mapping.get(column_header_text)
-                if column_name:
-                    index_mapping[idx] = column_name
-                else:
-                    excluded_idx.append(idx)
-                    if column_header_text.strip() != '':
-                        logging.debug(f'Column mapping not found: {column_header_text} URL: {url}')
-            tbody = table.css('tbody.tableBlock__body')
-            rows = tbody.css('tr.tableBlock__row, table')
-            for row in rows:
-                if row.root.tag == 'table':
-                    break
-                cells = row.css('td.tableBlock__col')
-                record = {}
-                for idx, cell in enumerate(cells):
-                    name = index_mapping.get(idx)
-                    if name:
-                        values = cell.css('::text, *::text').getall()
-                        record[name] = self.normalize_string(' '.join(values))
-                    else:
-                        if idx not in excluded_idx:
-                            logging.debug(f'Column name for index {idx} not found. URL: {url}')
-                result.append(record)
-        return result
-
-    def normalize_string(self, input_str: str) -> str:
-        return normalization_pattern.sub(' ', input_str).strip()
-
-    def parse_number(self, input_str: str) -> Optional[float]:
-        if not input_str:
-            return None
-        return float(re.sub(r',', '.', re.findall(r'[-+]?\d*[.,]\d+|\d+', re.sub(r'\s', '', input_str.strip()))[0]))
\ No newline at end of file
+    @timed('parse_suppliers')
+    @tracked
+    def parse_suppliers(self, response, purchase_id, due=None):
+        suppliers = self.extractor.extract_suppliers(response.selector.root, response.request.url)
+        if suppliers is None:
+            # No results published yet, the purchase stays pending for the next enrich run. A purchase without
+            # results long after they were due (e.g. a cancelled one) never gets them and is no longer revisited.
+            if due is not None and due + self.suppliers_max_age < self.today:
+                self.crawler.stats.inc_value('purchases/suppliers_expired', spider=self)
+                yield SuppliersPatch(purchase_id, [], SUPPLIERS_NONE)
+            return
+        yield SuppliersPatch(purchase_id, suppliers, SUPPLIERS_DONE)
@@ -0,0 +1,163 @@
+import datetime
+import glob
+import gzip
+import io
+import json
+import logging
+import os
+from typing import IO, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+# Raised when a compressed file ends before its end-of-stream marker
+TRUNCATION_ERRORS = (EOFError, zstandard.ZstdError) if zstandard is not None else (EOFError,)
+DATE_FIELDS = ('placement_date', 'application_deadline')
+
+
+def open_compressed(path: str, mode: str, compression: Optional[str] = None) -> IO:
+    # mode is 'r' or 'a' (text); compression is guessed from the extension when not given
+    if compression is None:
+        compression = 'gzip' if path.endswith('.gz') else 'zstd' if path.endswith('.zst') else 'none'
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd compression requires the zstandard package')
+        raw = open(path, mode + 'b')
+        if mode == 'r':
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class RotatingJsonLinesWriter:
+    def __init__(self, directory: str, prefix: str = 'purchases', compression: str = 'gzip', rotate_bytes: int = 256 * 1024 * 1024):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression: {compression}')
+        if compression == 'zstd' and zstandard is None:
+            raise RuntimeError('zstd compression requires the zstandard package')
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.rotate_bytes = rotate_bytes
+        self.file = None
+        self.path = None
+        self.written = 0
+        self.sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, document: dict):
+        if self.file is None or self.written >= self.rotate_bytes:
+            self.rotate()
+        line = json.dumps(document, ensure_ascii=False, default=json_default) + '\n'
+        self.file.write(line)
+        self.written += len(line)
+
+    def rotate(self):
+        self.close()
+        # Timestamp and pid keep file names unique across runs and parallel crawl processes
+        started = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(self.directory, f'{self.prefix}-{started}-{os.getpid()}-{self.sequence:04d}.jsonl{COMPRESSIONS[self.compression]}')
+        self.file = open_compressed(self.path, 'a', self.compression)
+        self.written = 0
+        self.sequence += 1
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def restore_dates(document: dict) -> dict:
+    # Dates are ISO strings in JSON; mongo gets them back as native dates
+    for field in DATE_FIELDS:
+        value = document.get(field)
+        if isinstance(value, str) and 'T' in value:
+            try:
+                document[field] = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                pass
+    return document
+
+
+def input_files(paths: List[str]) -> Iterator[str]:
+    # Files, globs or directories (their .jsonl* files), each in name order
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(glob.glob(os.path.join(path, '*.jsonl*')))
+        else:
+            yield from sorted(glob.glob(path)) or [path]
+
+
+def read_documents(path: str, buffer_size: int = 1024 * 1024) -> Iterator[dict]:
+    # JSON Lines files are read line by line; a legacy .json file holding one big array is decoded
+    # element by element, so neither is ever loaded into memory as a whole.
+    # A segment cut off by a crash ends early: the documents before the cut are read, the rest is logged as lost.
+    with open_compressed(path, 'r') as f:
+        try:
+            if '.jsonl' in os.path.basename(path):
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        document = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Only the last line of a cut segment may be incomplete
+                        if line.endswith('\n'):
+                            raise
+                        logging.warning(f'Truncated file, the last line is incomplete: {path}')
+                        return
+                    yield document
+            else:
+                yield from iter_json_array(f, buffer_size)
+        except TRUNCATION_ERRORS as e:
+            logging.warning(f'Truncated file, read up to the cut: {path} ({e})')
+
+
+def iter_json_array(f: IO, buffer_size: int) -> Iterator[dict]:
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if not started and position < len(buffer):
+            if buffer[position] != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            position += 1
+            continue
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            document, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                if buffer[position:].strip():
+                    raise
+                return
+            chunk = f.read(buffer_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield document
+        position = end
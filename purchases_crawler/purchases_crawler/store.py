@@ -0,0 +1,167 @@
+import logging
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+from purchases_crawler.purchases_crawler.items import SUPPLIERS_PENDING
+from purchases_crawler.purchases_crawler.telemetry import StageTimings
+
+DUPLICATE_KEY_ERROR = 11000
+PENDING_FIELDS = {'_id': 0, 'id': 1, 'suppliers_url': 1, 'application_deadline': 1, 'placement_date': 1}
+
+
+class PurchaseStore:
+    # Storage shared by the spider (known ids, pending enrichment) and the pipeline (bulk upserts).
+    # Every method returns a Deferred. Writes in flight are counted so the pipeline can hold items,
+    # and with them the scheduler, while the database lags behind.
+    def __init__(self, max_pending_writes: int = 4, timings: Optional[StageTimings] = None):
+        self.max_pending_writes = max_pending_writes
+        self.timings = timings or StageTimings()
+        self.pending_writes = 0
+        self.waiting: List[defer.Deferred] = []
+
+    @property
+    def saturated(self) -> bool:
+        return self.pending_writes >= self.max_pending_writes
+
+    def capacity(self) -> defer.Deferred:
+        # Fires once fewer than max_pending_writes writes are in flight
+        if not self.saturated:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.waiting.append(d)
+        return d
+
+    def upsert(self, documents: List[dict]) -> defer.Deferred:
+        # Fires with (upserted, matched or duplicate, failed) counts
+        self.pending_writes += 1
+        d = self.run(self.write, documents)
+        d.addBoth(self.write_finished)
+        return d
+
+    def write_finished(self, result):
+        self.pending_writes -= 1
+        while self.waiting and not self.saturated:
+            self.waiting.pop(0).callback(None)
+        return result
+
+    def load_ids(self, consumer: Callable[[Iterable[str]], None]) -> defer.Deferred:
+        return self.run(lambda: consumer(self.ids()))
+
+    def pending_suppliers(self) -> defer.Deferred:
+        return self.run(lambda: list(self.find_pending()))
+
+    def run(self, function, *args, **kwargs) -> defer.Deferred:
+        raise NotImplementedError
+
+    def ids(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def find_pending(self) -> Iterable[dict]:
+        raise NotImplementedError
+
+    def write(self, documents: List[dict]) -> (int, int, int):
+        raise NotImplementedError
+
+    def ensure_indexes(self) -> defer.Deferred:
+        return defer.succeed(None)
+
+    @staticmethod
+    def update(document: dict) -> dict:
+        # Writes run concurrently, so a card can be written after its supplier results patch; a pending
+        # status is therefore only set on insert and never resets results stored before
+        if document.get('suppliers_status') != SUPPLIERS_PENDING:
+            return {'$set': document}
+        document = dict(document)
+        return {'$set': document, '$setOnInsert': {'suppliers_status': document.pop('suppliers_status')}}
+
+    def close(self):
+        pass
+
+
+class MongoStore(PurchaseStore):
+    # pymongo calls run on a bounded thread pool of their own, never on the reactor thread
+    def __init__(self, connection_string: str, collection: str = 'purchases', pool_size: int = 4, write_concern=1,
+                 max_pending_writes: int = 4, timings: Optional[StageTimings] = None):
+        super().__init__(max_pending_writes, timings)
+        self.client = MongoClient(connection_string, maxPoolSize=pool_size, connect=False)
+        self.collection = self.client.get_database()[collection].with_options(write_concern=WriteConcern(w=write_concern))
+        self.pool = ThreadPool(minthreads=1, maxthreads=pool_size, name='mongo')
+        self.pool.start()
+
+    @classmethod
+    def from_settings(cls, connection_string: str, settings, timings: Optional[StageTimings] = None):
+        write_concern = settings.get('MONGO_WRITE_CONCERN', 1)
+        return cls(connection_string,
+                   pool_size=settings.getint('MONGO_POOL_SIZE', 4),
+                   write_concern=int(write_concern) if str(write_concern).isdigit() else write_concern,
+                   max_pending_writes=settings.getint('MONGO_MAX_PENDING_WRITES', 4),
+                   timings=timings)
+
+    def run(self, function, *args, **kwargs) -> defer.Deferred:
+        return threads.deferToThreadPool(reactor, self.pool, function, *args, **kwargs)
+
+    def ensure_indexes(self) -> defer.Deferred:
+        return self.run(self.collection.create_index, [('id', 1)], unique=True)
+
+    def ids(self) -> Iterable[str]:
+        for document in self.collection.find({}, {'id': 1, '_id': 0}).batch_size(10000):
+            if document.get('id'):
+                yield document['id']
+
+    def find_pending(self) -> Iterable[dict]:
+        return self.collection.find({'suppliers_status': SUPPLIERS_PENDING}, PENDING_FIELDS).batch_size(10000)
+
+    def write(self, documents: List[dict]) -> (int, int, int):
+        requests = [UpdateOne({'id': document['id']}, self.update(document), upsert=True) for document in documents]
+        try:
+            with self.timings.stage('mongo_write'):
+                result = self.collection.bulk_write(requests, ordered=False)
+            return result.upserted_count, result.matched_count, 0
+        except BulkWriteError as e:
+            details = e.details
+            duplicates = 0
+            failed = 0
+            for error in details.get('writeErrors', []):
+                if error.get('code') == DUPLICATE_KEY_ERROR:
+                    duplicates += 1
+                else:
+                    failed += 1
+                    logging.warning(f'Mongo write failed: {error.get("errmsg")} ID: {documents[error["index"]].get("id")}')
+            return details.get('nUpserted', 0), details.get('nMatched', 0) + duplicates, failed
+
+    def close(self):
+        self.pool.stop()
+        self.client.close()
+
+
+class MemoryStore(PurchaseStore):
+    # In-process stand-in with the same semantics ($set upserts keyed by id), for benchmarks and checks
+    def __init__(self, documents: Optional[Iterable[dict]] = None, max_pending_writes: int = 4,
+                 timings: Optional[StageTimings] = None):
+        super().__init__(max_pending_writes, timings)
+        self.documents: Dict[str, dict] = {document['id']: dict(document) for document in documents or []}
+
+    def run(self, function, *args, **kwargs) -> defer.Deferred:
+        return defer.maybeDeferred(function, *args, **kwargs)
+
+    def ids(self) -> Iterable[str]:
+        return list(self.documents)
+
+    def find_pending(self) -> Iterable[dict]:
+        return [{key: document.get(key) for key in PENDING_FIELDS if key != '_id'}
+                for document in self.documents.values() if document.get('suppliers_status') == SUPPLIERS_PENDING]
+
+    def write(self, documents: List[dict]) -> (int, int, int):
+        upserted = 0
+        for document in documents:
+            update = self.update(document)
+            if document['id'] not in self.documents:
+                self.documents[document['id']] = dict(update.get('$setOnInsert', {}))
+                upserted += 1
+            self.documents[document['id']].update(update['$set'])
+        return upserted, len(documents) - upserted, 0
@@ -0,0 +1,227 @@
+import cProfile
+import datetime
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import reactor, task
+from twisted.web import resource, server
+
+
+class StageTimings:
+    # Wall time, call count and slowest call per crawl stage (callbacks, table parsing, dedup lookups,
+    # storage writes). Pipelines write from worker threads, hence the lock.
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.slowest: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.profile_stages = ()
+        self.profile_rate = 0.0
+
+    def add(self, stage: str, seconds: float, calls: int = 1):
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+            if seconds > self.slowest.get(stage, 0.0):
+                self.slowest[stage] = seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def profile(self, stages: List[str], rate: float):
+        self.profiler = cProfile.Profile()
+        self.profile_stages = tuple(stages)
+        self.profile_rate = rate
+
+    def sampled(self, stage: str) -> bool:
+        return self.profiler is not None and stage in self.profile_stages and random.random() < self.profile_rate
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {stage: {'seconds': round(self.seconds[stage], 6), 'calls': self.calls[stage],
+                            'slowest': round(self.slowest[stage], 6)} for stage in self.seconds}
+
+
+def callback_wrapper(wrapper, callback):
+    # functools.wraps without __wrapped__: Scrapy reads the source of generator callbacks to warn about
+    # 'return value' statements, and the source of a decorated method does not parse on its own. It reads
+    # the wrapper's source instead, which is why wrappers are not defined under a decorator either.
+    functools.update_wrapper(wrapper, callback)
+    del wrapper.__wrapped__
+    return wrapper
+
+
+def timed(stage: str):
+    # For generator callbacks: only the time spent inside the callback counts, not the time Scrapy spends
+    # on the requests and items between two resumptions. Sampled calls run under the profiler.
+    def decorator(callback):
+        def wrapper(spider, *args, **kwargs):
+            timings = spider.timings
+            profiler = timings.profiler if timings.sampled(stage) else None
+            elapsed = 0.0
+            iterator = iter(callback(spider, *args, **kwargs))
+            try:
+                while True:
+                    started = time.perf_counter()
+                    if profiler is not None:
+                        profiler.enable()
+                    try:
+                        value = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        if profiler is not None:
+                            profiler.disable()
+                        elapsed += time.perf_counter() - started
+                    yield value
+            finally:
+                timings.add(stage, elapsed)
+        return callback_wrapper(wrapper, callback)
+    return decorator
+
+
+class PrometheusResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, telemetry):
+        super().__init__()
+        self.telemetry = telemetry
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.telemetry.prometheus().encode('utf-8')
+
+
+class CrawlTelemetry:
+    # Periodically computes per-date item rates and dumps them with stage timings, queue depths and crawl
+    # stats to TELEMETRY_FILE; serves the same numbers in Prometheus text format on 127.0.0.1.
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('TELEMETRY_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.interval = settings.getfloat('TELEMETRY_INTERVAL', 60.0)
+        self.file = settings.get('TELEMETRY_FILE') or None
+        self.port = settings.getint('TELEMETRY_PROMETHEUS_PORT')
+        self.profile_stages = settings.getlist('TELEMETRY_PROFILE_STAGES')
+        self.profile_rate = settings.getfloat('TELEMETRY_PROFILE_RATE', 0.01)
+        self.profile_file = settings.get('TELEMETRY_PROFILE_FILE', 'profile.pstats')
+        self.spider = None
+        self.loop = None
+        self.listener = None
+        self.date_items: Dict[str, int] = {}
+        self.date_items_before: Dict[str, int] = {}
+        self.date_rates: Dict[str, float] = {}
+        self.sampled_at = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        return extension
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        if self.profile_stages:
+            spider.timings.profile(self.profile_stages, self.profile_rate)
+        self.sampled_at = time.monotonic()
+        self.loop = task.LoopingCall(self.sample)
+        self.loop.start(self.interval, now=False)
+        if self.port:
+            self.listener = reactor.listenTCP(self.port, server.Site(PrometheusResource(self)), interface='127.0.0.1')
+            logging.info(f'Prometheus metrics on http://127.0.0.1:{self.port}/metrics')
+
+    def spider_closed(self, spider, reason):
+        if self.spider is None:
+            return
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.sample()
+        if self.listener is not None:
+            self.listener.stopListening()
+        if spider.timings.profiler is not None:
+            spider.timings.profiler.dump_stats(self.profile_file)
+            logging.info(f'Profile of sampled {", ".join(self.profile_stages)} calls written to {self.profile_file}')
+
+    def item_scraped(self, item, response, spider):
+        partition = response.meta.get('partition')
+        if partition is not None:
+            self.date_items[partition[0]] = self.date_items.get(partition[0], 0) + 1
+
+    def queue_depths(self) -> dict:
+        engine = self.crawler.engine
+        if engine is None or engine.slot is None:
+            return {}
+        downloader = engine.downloader
+        return {
+            'scheduler': len(engine.slot.scheduler),
+            'downloader_active': len(downloader.active),
+            'downloader_queued': sum(len(slot.queue) for slot in downloader.slots.values()),
+            'downloader_transferring': sum(len(slot.transferring) for slot in downloader.slots.values()),
+            'scraper_active': len(engine.scraper.slot.active) if engine.scraper.slot is not None else 0,
+        }
+
+    def sample(self):
+        now = time.monotonic()
+        minutes = max(now - self.sampled_at, 1e-6) / 60
+        self.date_rates = {date: round((count - self.date_items_before.get(date, 0)) / minutes, 2)
+                           for date, count in self.date_items.items() if count > self.date_items_before.get(date, 0)}
+        self.date_items_before = dict(self.date_items)
+        self.sampled_at = now
+        if self.file:
+            self.dump()
+
+    def snapshot(self) -> dict:
+        stats = {key: value for key, value in self.crawler.stats.get_stats().items()
+                 if isinstance(value, (int, float)) and not isinstance(value, bool)}
+        return {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'stages': self.spider.timings.snapshot() if self.spider is not None else {},
+            'queues': self.queue_depths(),
+            'items_per_minute_by_date': self.date_rates,
+            'items_by_date': self.date_items,
+            'stats': stats,
+        }
+
+    def dump(self):
+        path = f'{self.file}.tmp'
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(path, self.file)
+
+    def prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = ['# TYPE purchases_crawler_stage_seconds_total counter',
+                 '# TYPE purchases_crawler_stage_calls_total counter',
+                 '# TYPE purchases_crawler_stage_slowest_seconds gauge']
+        for stage, timing in snapshot['stages'].items():
+            lines.append(f'purchases_crawler_stage_seconds_total{{stage="{stage}"}} {timing["seconds"]}')
+            lines.append(f'purchases_crawler_stage_calls_total{{stage="{stage}"}} {timing["calls"]}')
+            lines.append(f'purchases_crawler_stage_slowest_seconds{{stage="{stage}"}} {timing["slowest"]}')
+        lines.append('# TYPE purchases_crawler_queue_depth gauge')
+        for queue, depth in snapshot['queues'].items():
+            lines.append(f'purchases_crawler_queue_depth{{queue="{queue}"}} {depth}')
+        lines.append('# TYPE purchases_crawler_items_per_minute gauge')
+        for date, rate in snapshot['items_per_minute_by_date'].items():
+            lines.append(f'purchases_crawler_items_per_minute{{placement_date="{date}"}} {rate}')
+        lines.append('# TYPE purchases_crawler_stat untyped')
+        for key, value in snapshot['stats'].items():
+            lines.append(f'purchases_crawler_stat{{name="{key}"}} {value}')
+        return '\n'.join(lines) + '\n'
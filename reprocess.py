@@ -0,0 +1,130 @@
+import argparse
+import collections
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
+from parsel import Selector
+
+from purchases_crawler.purchases_crawler.items import SUPPLIERS_DONE, SUPPLIERS_PENDING, SuppliersPatch
+from purchases_crawler.purchases_crawler.spiders.goszakupki.card_extractor import CardExtractor
+from purchases_crawler.purchases_crawler.storage_files import COMPRESSIONS, RotatingJsonLinesWriter, input_files, read_documents
+from purchases_crawler.purchases_crawler.store import MongoStore
+
+extractor = None
+
+
+def reparse(pages: List[dict]) -> (List[dict], int):
+    # Runs in a worker process; the extractor and its compiled selectors are built once per process
+    global extractor
+    if extractor is None:
+        extractor = CardExtractor()
+    documents = []
+    failed = 0
+    for page in pages:
+        root = Selector(text=page['body'], type='html').root
+        try:
+            if page['kind'] == 'card':
+                document = extractor.extract_purchase(root, page['url']).as_document()
+                # A card never moves its stored supplier results back to pending; an archived
+                # supplier results page sets the stage when there is one
+                if document['suppliers_status'] == SUPPLIERS_PENDING:
+                    del document['suppliers_status']
+                documents.append(document)
+            else:
+                suppliers = extractor.extract_suppliers(root, page['url'])
+                if suppliers is not None:
+                    documents.append(SuppliersPatch(page['purchase_id'], suppliers, SUPPLIERS_DONE).as_document())
+        except Exception as e:
+            failed += 1
+            logging.warning(f'Reprocessing failed: {e} URL: {page["url"]}')
+    return documents, failed
+
+
+def page_batches(paths, batch_size: int, kinds) -> Iterator[List[dict]]:
+    batch = []
+    for path in paths:
+        for page in read_documents(path):
+            if page['kind'] not in kinds:
+                continue
+            batch.append(page)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        logging.info(f'Read {path}')
+    if batch:
+        yield batch
+
+
+def reparsed(batches, workers: int) -> Iterator[Tuple[List[dict], int]]:
+    # In archive order, with at most two batches per worker in flight, so memory stays flat however big the archive is
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = collections.deque()
+        for batch in batches:
+            futures.append(executor.submit(reparse, batch))
+            if len(futures) >= workers * 2:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Re-runs card and supplier results extraction over the raw pages archived '
+                                                 'with launcher.py --archive-raw and upserts the corrected purchases.')
+    parser.add_argument('paths', nargs='*', default=['archive'], help='Archive segments, globs or directories with .jsonl* files')
+    parser.add_argument('-s', '--storage', help='Where corrected purchases go: mongo db or JSON Lines files in --out-dir '
+                                                '(for mongo_import.py)', choices=('mongo', 'jsonl'), default='mongo')
+    parser.add_argument('-cs', '--connection-string', help='Connection string to mongo db, with the database name and any '
+                                                     'credentials', action='store', default='mongodb://localhost:27017/zakupki')
+    parser.add_argument('-c', '--collection', help='Collection name', action='store', default='purchases')
+    parser.add_argument('-o', '--out-dir', help='Output directory for jsonl storage', action='store', default='reprocessed')
+    parser.add_argument('--compression', help='Compression of jsonl output files', choices=COMPRESSIONS, default='gzip')
+    parser.add_argument('--kind', help='Reprocess only this kind of page', choices=['card', 'suppliers'], action='append', default=[])
+    parser.add_argument('-j', '--jobs', help='Worker processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', help='Pages per worker task', type=int, default=200)
+    parser.add_argument('--chunk-size', help='Documents per bulk write', type=int, default=1000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+    store = MongoStore(args.connection_string, args.collection) if args.storage == 'mongo' else None
+    writer = RotatingJsonLinesWriter(args.out_dir, compression=args.compression) if args.storage == 'jsonl' else None
+    written = 0
+    failed = 0
+    chunk = {}
+
+    def flush():
+        nonlocal written, failed
+        if store is not None:
+            upserted, matched, write_failed = store.write(list(chunk.values()))
+            written += upserted + matched
+            failed += write_failed
+        else:
+            for document in chunk.values():
+                writer.write(document)
+            written += len(chunk)
+        chunk.clear()
+
+    batches = page_batches(sorted(input_files(args.paths), key=os.path.basename), args.batch_size,
+                           set(args.kind or ['card', 'suppliers']))
+    try:
+        for documents, parse_failed in reparsed(batches, args.jobs):
+            failed += parse_failed
+            for document in documents:
+                # Supplier results patches follow their cards; merging keeps them in order within unordered writes
+                chunk.setdefault(document['id'], {}).update(document)
+            if len(chunk) >= args.chunk_size:
+                flush()
+                logging.info(f'Written: {written} Failed: {failed}')
+        if chunk:
+            flush()
+        logging.info(f'Reprocessing finished. Written: {written} Failed: {failed}')
+    finally:
+        if store is not None:
+            store.close()
+        if writer is not None:
+            writer.close()
+
+
+if __name__ == '__main__':
+    run()